@@ -0,0 +1,442 @@
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+from dateutil.parser import parse as parse_date
+from dateutil.utils import default_tzinfo
+from dateutil.tz import gettz
+from tempfile import TemporaryDirectory
+from threading import Event as ThreadingEvent, Thread
+
+from warptrail import (
+    EXPORT_FORMATS,
+    DatabaseWriter,
+    WarpTrailApp,
+    classify_line,
+    parse_log_timestamp,
+)
+
+NOISE_LINES = [
+    "{} Log        -  [Network Processing] RPC invoked ConfigurePortal on Portals for Everyone\n",
+    "{} Debug      -  [AssetBundleDownloadManager] Starting download of avtr_c38a1615-5bf5-42b4-84eb-a8b6c37cbd11\n",
+    "{} Warning    -  Material doesn't have a texture property '_MainTex'\n",
+    "{} Log        -  [Behaviour] Switching KittyHawk to avatar Fox\n",
+]
+
+WORLD_JOIN_LINE = "{} Log        -  [Behaviour] Joining {}:{}~private(usr_00000000-0000-0000-0000-000000000000)\n"
+WORLD_NAME_LINE = "{} Log        -  [Behaviour] Joining or Creating Room: {}\n"
+PLAYER_JOIN_LINE = "{} Log        -  [Behaviour] OnPlayerJoined {}\n"
+PLAYER_LEAVE_LINE = "{} Log        -  [Behaviour] OnPlayerLeft {}\n"
+
+LOG_START = datetime(2022, 4, 5, 21, 44, 16)
+
+
+def world_id(rng):
+    return "wrld_{:08x}-{:04x}-{:04x}-{:04x}-{:012x}".format(
+        rng.getrandbits(32),
+        rng.getrandbits(16),
+        rng.getrandbits(16),
+        rng.getrandbits(16),
+        rng.getrandbits(48),
+    )
+
+
+def iter_log_lines(count, noise_ratio=0.98, world_hops=100, players=500, seed=0):
+    rng = random.Random(seed)
+    worlds = [world_id(rng) for _ in range(max(world_hops // 2, 1))]
+    names = ["Player {}".format(number) for number in range(players)]
+    hop_every = max(count // max(world_hops, 1), 1)
+
+    present = []
+    for index in range(count):
+        # VRChat writes a few lines a second, so the timestamps advance slowly
+        timestamp = (LOG_START + timedelta(seconds=index // 4)).strftime(
+            "%Y.%m.%d %H:%M:%S"
+        )
+
+        if index % hop_every == 0:
+            # Players in the old instance aren't reported as leaving, same as
+            # in real logs; the next world's join closes them
+            present = []
+            world = rng.choice(worlds)
+            yield WORLD_JOIN_LINE.format(timestamp, world, rng.randrange(100000))
+        elif index % hop_every == 1:
+            yield WORLD_NAME_LINE.format(timestamp, "World {}".format(world[5:13]))
+        elif rng.random() < noise_ratio:
+            yield rng.choice(NOISE_LINES).format(timestamp)
+        elif present and (rng.random() < 0.5 or len(present) == len(names)):
+            yield PLAYER_LEAVE_LINE.format(
+                timestamp, present.pop(rng.randrange(len(present)))
+            )
+        else:
+            name = rng.choice(names)
+            if name not in present:
+                present.append(name)
+            yield PLAYER_JOIN_LINE.format(timestamp, name)
+
+
+def write_log(path, lines, **options):
+    with open(path, "w", encoding="utf-8", buffering=1024 * 1024) as log_file:
+        for line in iter_log_lines(lines, **options):
+            log_file.write(line)
+    return os.path.getsize(path)
+
+
+# The line handling from before classify_line existed, kept for comparison
+def legacy_classify_line(line):
+    match = re.search("([0-9.]+ [0-9:]+).+Joining (wrld_[0-9a-f-]{36})", line)
+    if match != None:
+        default_tzinfo(parse_date(match.group(1)), gettz())
+
+    match = re.search("[0-9.]+ [0-9:]+.+Joining or Creating Room: (.+)", line)
+
+    match = re.search("([0-9.]+ [0-9:]+).+OnPlayerJoined (.+)", line)
+    if match != None:
+        default_tzinfo(parse_date(match.group(1)), gettz())
+
+    match = re.search("([0-9.]+ [0-9:]+).+OnPlayerLeft (.+)", line)
+    if match != None:
+        default_tzinfo(parse_date(match.group(1)), gettz())
+
+
+def current_classify_line(line):
+    event = classify_line(line)
+    if event is not None and event[0] != "world_name":
+        parse_log_timestamp(event[1])
+
+
+def measure(function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+
+    samples = sorted(samples)
+    return {
+        "p50": samples[len(samples) // 2] * 1000,
+        "p95": samples[int(len(samples) * 0.95)] * 1000,
+        "max": samples[-1] * 1000,
+    }
+
+
+def bench_parse(args):
+    lines = list(
+        iter_log_lines(args.lines, noise_ratio=1 - args.event_ratio, seed=args.seed)
+    )
+
+    before = measure(legacy_classify_line, lines)
+    after = measure(current_classify_line, lines)
+
+    return {
+        "lines": len(lines),
+        "legacy_lines_per_second": before,
+        "lines_per_second": after,
+        "speedup": after / before,
+    }
+
+
+def bench_ingest(args):
+    with TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "output_log_bench.txt")
+        size = write_log(
+            log_path,
+            args.lines,
+            noise_ratio=args.noise_ratio,
+            world_hops=args.world_hops,
+            players=args.players,
+            seed=args.seed,
+        )
+
+        app = WarpTrailApp(user_data_dir=directory, vrchat_data_dir=directory)
+        app.stop_event = ThreadingEvent()
+        # Archiving is timed on its own, below
+        app.archive_logs = False
+
+        commits = []
+        app.writer.on_commit = lambda count, seconds: commits.append(seconds)
+
+        # Without a responsible process the follower stops at the end of the
+        # file, so this times reading, classifying and writing everything
+        start = time.perf_counter()
+        app.follow_log_file(log_path, None)
+        follow_seconds = time.perf_counter() - start
+        follow_commits = commits[:]
+
+        # Start the backfill from an empty database, with nothing still
+        # holding the old one open
+        app.readers.close()
+        app.writer.stop()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(app.database_path + suffix):
+                os.remove(app.database_path + suffix)
+        app = WarpTrailApp(user_data_dir=directory, vrchat_data_dir=directory)
+        app.archive_logs = False
+        del commits[:]
+        app.writer.on_commit = lambda count, seconds: commits.append(seconds)
+
+        start = time.perf_counter()
+        app.backfill(paths=[log_path], max_workers=1)
+        backfill_seconds = time.perf_counter() - start
+
+        app.archive_logs = True
+        start = time.perf_counter()
+        app.archive_log(log_path)
+        app.writer.flush()
+        archive_seconds = time.perf_counter() - start
+        archive_size = os.path.getsize(app.archive_path(log_path))
+
+        start = time.perf_counter()
+        app.reingest()
+        reingest_seconds = time.perf_counter() - start
+        app.writer.stop()
+
+        return {
+            "lines": args.lines,
+            "bytes": size,
+            "follow": {
+                "seconds": follow_seconds,
+                "lines_per_second": args.lines / follow_seconds,
+                "commits": len(follow_commits),
+                "commit_latency_ms": percentiles(follow_commits),
+            },
+            "backfill": {
+                "seconds": backfill_seconds,
+                "lines_per_second": args.lines / backfill_seconds,
+                "commits": len(commits),
+                "commit_latency_ms": percentiles(commits),
+            },
+            "archive": {
+                "seconds": archive_seconds,
+                "bytes": archive_size,
+                "ratio": size / archive_size,
+            },
+            "reingest": {
+                "seconds": reingest_seconds,
+                "lines_per_second": args.lines / reingest_seconds,
+            },
+        }
+
+
+def fill_database(database_path, checkins, seed=0):
+    rng = random.Random(seed)
+    worlds = [world_id(rng) for _ in range(1000)]
+    start = int(LOG_START.timestamp())
+
+    db_conn = sqlite3.connect(database_path)
+    with db_conn:
+        db_conn.executemany(
+            "INSERT INTO worlds (id, name) VALUES (?, ?)",
+            ((world, "World {}".format(world[5:13])) for world in worlds),
+        )
+        db_conn.executemany(
+            "INSERT INTO checkins (world_id, start_time, start_offset, end_time, end_offset) VALUES (?, ?, -420, ?, -420)",
+            (
+                (rng.choice(worlds), start + index * 600, start + index * 600 + 540)
+                for index in range(checkins)
+            ),
+        )
+    db_conn.close()
+
+
+def measure_writes(writer, running, count=None):
+    # Round trips through the writer for a small update, like the ones a
+    # follower makes, for as long as running() or count times
+    samples = []
+    while running() if count is None else len(samples) < count:
+        start = time.perf_counter()
+        writer.execute("UPDATE checkins SET end_time = end_time WHERE id = 1")
+        writer.flush()
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    return samples
+
+
+def bench_export(args):
+    with TemporaryDirectory() as directory:
+        app = WarpTrailApp(user_data_dir=directory, vrchat_data_dir=directory)
+        app.writer.stop()
+        fill_database(app.database_path, args.checkins, seed=args.seed)
+
+        results = {"checkins": args.checkins}
+        for extension in EXPORT_FORMATS:
+            output_path = os.path.join(directory, "export" + extension)
+
+            with open(output_path, "w", encoding="utf-8") as output_file:
+                start = time.perf_counter()
+                app.format_as(extension, output_file)
+                seconds = time.perf_counter() - start
+
+            result = {
+                "seconds": seconds,
+                "rows_per_second": args.checkins / seconds,
+                "bytes": os.path.getsize(output_path),
+            }
+
+            # Tracing allocations slows everything down, so memory gets its
+            # own run rather than skewing the timings
+            if not args.skip_memory:
+                with open(output_path, "w", encoding="utf-8") as output_file:
+                    tracemalloc.start()
+                    app.format_as(extension, output_file)
+                    (_, peak) = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                result["peak_memory_bytes"] = peak
+
+            results[extension] = result
+
+        # Exports read from their own snapshot, so shouldn't slow the writer
+        writer = DatabaseWriter(app.database_path)
+        writer.start()
+        idle = measure_writes(writer, None, count=50)
+
+        output_path = os.path.join(directory, "export.json")
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            export = Thread(target=app.format_as, args=(".json", output_file))
+            export.start()
+            exporting = measure_writes(writer, export.is_alive)
+            export.join()
+        writer.stop()
+
+        results["write_latency_ms"] = {
+            "idle": percentiles(idle),
+            "exporting": percentiles(exporting),
+        }
+
+        return results
+
+
+HEAVY_MODULES = ["tkinter", "PIL", "pystray", "watchdog", "dateutil", "psutil"]
+
+STARTUP_SCRIPT = """
+import json, sys, time
+from tempfile import TemporaryDirectory
+start = time.perf_counter()
+import warptrail
+imported = time.perf_counter()
+with TemporaryDirectory() as directory:
+    app = warptrail.WarpTrailApp(user_data_dir=directory, vrchat_data_dir=directory)
+    started = time.perf_counter()
+    app.writer.stop()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "startup_seconds": started - start,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def bench_startup(args):
+    # Each run needs a fresh interpreter, or everything is already imported
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT % HEAVY_MODULES],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(args.runs)
+    ]
+
+    return {
+        "runs": args.runs,
+        "import_seconds": min(run["import_seconds"] for run in runs),
+        "startup_seconds": min(run["startup_seconds"] for run in runs),
+        "loaded": runs[0]["loaded"],
+    }
+
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "ingest": bench_ingest,
+    "export": bench_export,
+    "startup": bench_startup,
+}
+
+
+def add_log_arguments(parser):
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--noise-ratio", type=float, default=0.98)
+    parser.add_argument("--world-hops", type=int, default=100)
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WarpTrail benchmarks")
+    parser.add_argument(
+        "--output", help="write results to this JSON file instead of stdout"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    parse_parser = subparsers.add_parser("parse", help="time line classification")
+    parse_parser.add_argument("--lines", type=int, default=200000)
+    parse_parser.add_argument("--event-ratio", type=float, default=0.02)
+    parse_parser.add_argument("--seed", type=int, default=0)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="write a synthetic VRChat log"
+    )
+    generate_parser.add_argument("path")
+    add_log_arguments(generate_parser)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="time following and backfilling a synthetic log"
+    )
+    add_log_arguments(ingest_parser)
+
+    export_parser = subparsers.add_parser("export", help="time exporting each format")
+    export_parser.add_argument("--checkins", type=int, default=1000000)
+    export_parser.add_argument("--seed", type=int, default=0)
+    export_parser.add_argument("--skip-memory", action="store_true")
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="time importing warptrail and starting the app"
+    )
+    startup_parser.add_argument("--runs", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        size = write_log(
+            args.path,
+            args.lines,
+            noise_ratio=args.noise_ratio,
+            world_hops=args.world_hops,
+            players=args.players,
+            seed=args.seed,
+        )
+        print("Wrote {:,} lines ({:,} bytes) to {}".format(args.lines, size, args.path))
+        sys.exit()
+
+    results = {
+        "benchmark": args.command or "parse",
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": BENCHMARKS[args.command or "parse"](
+            args if args.command else parse_parser.parse_args([])
+        ),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
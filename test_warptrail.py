@@ -1,18 +1,91 @@
 import unittest
 
-from warptrail import WarpTrailApp
+from warptrail import (
+    MIGRATIONS,
+    DatabaseWriter,
+    ExportJob,
+    FeedSink,
+    LogFollowers,
+    MemorySink,
+    PlayerJoin,
+    PlayerLeave,
+    VRChatProcesses,
+    WarpTrailApp,
+    WorldJoin,
+    WorldName,
+    archive_log_file,
+    classify_line,
+    iter_events,
+    log_created_time,
+    parse_log_timestamp,
+    read_archive_lines,
+    serve_metrics,
+    to_timestamp,
+)
 
+import glob
 import io
+import json
 import os
 import sqlite3
 import sys
+import time
+
+from urllib.request import urlopen
+from dateutil.parser import parse as parse_date
+from dateutil.utils import default_tzinfo
+from dateutil.tz import gettz
 from tempfile import TemporaryDirectory
+from threading import Event as ThreadingEvent, Thread
+
+# The schema databases were created with before migrations were tracked
+LEGACY_DB_SCHEMA = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS worlds (
+    id TEXT NOT NULL PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS checkins (
+    world_id TEXT NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT,
+    FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX checkins_world_id_time_unique ON checkins(world_id, start_datetime); 
+
+CREATE TABLE IF NOT EXISTS visitors (
+    world_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT,
+    FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX visitors_world_id_name_time_unique ON visitors(world_id, name, start_datetime); 
+"""
 
 DB_CHECKIN_FIXTURES = """
 INSERT INTO "worlds" VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 'VRChat Home');
 INSERT INTO "worlds" VALUES ('wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e', NULL);
 INSERT INTO "worlds" VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', 'Just Rain');
 INSERT INTO "worlds" VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', 'Reflections 2');
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e', strftime('%s', '2022-04-05T21:44:16-07:00'), -420, NULL, NULL);
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', strftime('%s', '2022-04-05T23:02:13-07:00'), -420, strftime('%s', '2022-04-05T23:02:28-07:00'), -420);
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', strftime('%s', '2022-04-10T18:08:22-07:00'), -420, strftime('%s', '2022-04-10T18:38:56-07:00'), -420);
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', strftime('%s', '2022-04-15T16:09:26-07:00'), -420, strftime('%s', '2022-04-15T16:10:35-07:00'), -420);
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', strftime('%s', '2022-04-15T18:13:51-07:00'), -420, strftime('%s', '2022-04-15T18:14:25-07:00'), -420);
+INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', strftime('%s', '2022-04-15T16:10:35-07:00'), -420, strftime('%s', '2022-04-15T16:39:21-07:00'), -420);
+"""
+
+# Check-ins as they were stored before times were kept as integers
+LEGACY_DB_CHECKIN_FIXTURES = """
+INSERT INTO "worlds" VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 'VRChat Home');
+INSERT INTO "worlds" VALUES ('wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e', NULL);
+INSERT INTO "worlds" VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', 'Just Rain');
+INSERT INTO "worlds" VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', 'Reflections 2');
 INSERT INTO "checkins" VALUES ('wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e', '2022-04-05T21:44:16-07:00', NULL);
 INSERT INTO "checkins" VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', '2022-04-05T23:02:13-07:00', '2022-04-05T23:02:28-07:00');
 INSERT INTO "checkins" VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', '2022-04-10T18:08:22-07:00', '2022-04-10T18:38:56-07:00');
@@ -21,6 +94,51 @@ INSERT INTO "checkins" VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', '202
 INSERT INTO "checkins" VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', '2022-04-15T16:10:35-07:00', '2022-04-15T16:39:21-07:00');
 """
 
+LOG_FIXTURE = """2022.04.05 21:44:10 Log        -  [Behaviour] Initialized PlayerAPI "KittyHawk" is local
+2022.04.05 21:44:16 Log        -  [Behaviour] Joining wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd:12345~private(usr_00000000-0000-0000-0000-000000000000)
+2022.04.05 21:44:17 Log        -  [Behaviour] Joining or Creating Room: VRChat Home
+2022.04.05 21:44:18 Log        -  [Behaviour] OnPlayerJoined KittyHawk
+2022.04.05 21:44:20 Log        -  [Behaviour] OnPlayerJoined Fox
+2022.04.05 21:50:02 Log        -  [Behaviour] OnPlayerLeft Fox
+2022.04.05 21:55:30 Log        -  [Behaviour] Joining wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399:67890~public
+2022.04.05 21:55:31 Log        -  [Behaviour] Joining or Creating Room: Just Rain
+2022.04.05 21:55:33 Log        -  [Behaviour] OnPlayerJoined KittyHawk
+"""
+
+
+class ExitingProcess:
+    # Stands in for a VRChat process which is still running when WarpTrail exits
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+
+    def is_running(self):
+        self.stop_event.set()
+        return True
+
+
+class FakeProcess:
+    def __init__(self, pid, created, running=True):
+        self.pid = pid
+        self.created = created
+        self.running = running
+
+    def is_running(self):
+        return self.running
+
+    def create_time(self):
+        return self.created
+
+
+class FakeVRChatProcesses(VRChatProcesses):
+    def __init__(self, processes):
+        super().__init__()
+        self.processes = processes
+        self.scans = 0
+
+    def scan(self):
+        self.scans += 1
+        return {process.pid: process for process in self.processes}
+
 
 class WarpTrailTests(unittest.TestCase):
     def test_get_user_data_dir(self):
@@ -35,6 +153,1043 @@ class WarpTrailTests(unittest.TestCase):
             ),
         )
 
+    def test_classify_line(self):
+        self.assertEqual(
+            classify_line(
+                "2022.04.05 21:44:16 Log        -  [Behaviour] Joining wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd:12345~private\n"
+            ),
+            (
+                "world_join",
+                "2022.04.05 21:44:16",
+                "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+            ),
+        )
+        self.assertEqual(
+            classify_line(
+                "2022.04.05 21:44:17 Log        -  [Behaviour] Joining or Creating Room: VRChat Home\n"
+            ),
+            ("world_name", "2022.04.05 21:44:17", "VRChat Home"),
+        )
+        self.assertEqual(
+            classify_line(
+                "2022.04.05 21:44:18 Log        -  [Behaviour] OnPlayerJoined KittyHawk\n"
+            ),
+            ("player_join", "2022.04.05 21:44:18", "KittyHawk"),
+        )
+        self.assertEqual(
+            classify_line(
+                "2022.04.05 21:44:19 Log        -  [Behaviour] OnPlayerLeft KittyHawk\n"
+            ),
+            ("player_leave", "2022.04.05 21:44:19", "KittyHawk"),
+        )
+        self.assertIsNone(
+            classify_line(
+                "2022.04.05 21:44:20 Log        -  [Behaviour] Switching KittyHawk to avatar Fox\n"
+            )
+        )
+        self.assertIsNone(classify_line("\n"))
+
+    def test_parse_log_timestamp(self):
+        self.assertEqual(
+            parse_log_timestamp("2022.04.05 21:44:16"),
+            default_tzinfo(parse_date("2022.04.05 21:44:16"), gettz()),
+        )
+
+    def test_backfill(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.backfill(paths=[log_path], max_workers=1)
+
+                db_conn = sqlite3.connect(app.database_path)
+                db = db_conn.cursor()
+
+                self.assertEqual(
+                    db.execute("SELECT id, name FROM worlds").fetchall(),
+                    [
+                        ("wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd", "VRChat Home"),
+                        ("wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399", "Just Rain"),
+                    ],
+                )
+                self.assertEqual(
+                    app.checkins_between()[0],
+                    (
+                        "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                        "VRChat Home",
+                        parse_log_timestamp("2022.04.05 21:44:16"),
+                        parse_log_timestamp("2022.04.05 21:55:30"),
+                    ),
+                )
+                self.assertEqual(
+                    [
+                        (name, end)
+                        for (world_id, name, start, end) in app.visitors_between()
+                        if world_id == "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd"
+                    ],
+                    [
+                        ("KittyHawk", parse_log_timestamp("2022.04.05 21:55:30")),
+                        ("Fox", parse_log_timestamp("2022.04.05 21:50:02")),
+                    ],
+                )
+
+                # Importing the same log again shouldn't duplicate anything
+                app.backfill(paths=[log_path], max_workers=1)
+
+                self.assertEqual(
+                    db.execute("SELECT count(*) FROM checkins").fetchone()[0], 2
+                )
+                self.assertEqual(
+                    db.execute("SELECT count(*) FROM visitors").fetchone()[0], 3
+                )
+                # Each player's name is only stored once
+                self.assertEqual(
+                    db.execute("SELECT name FROM players ORDER BY id").fetchall(),
+                    [("KittyHawk",), ("Fox",)],
+                )
+
+    def test_follow_log_file_resumes_from_checkpoint(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                # Stop part way through a line, as if VRChat were still writing it
+                split_at = LOG_FIXTURE.index("Left Fox")
+                (first_half, second_half) = (
+                    LOG_FIXTURE[:split_at],
+                    LOG_FIXTURE[split_at:],
+                )
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(first_half)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.follow_log_file(log_path, ExitingProcess(app.stop_event))
+
+                db_conn = sqlite3.connect(app.database_path)
+                db = db_conn.cursor()
+
+                (size, offset, world_id, finished) = db.execute(
+                    "SELECT size, offset, world_id, finished FROM checkpoints"
+                ).fetchone()
+                self.assertEqual(size, len(first_half.encode("utf-8")))
+                self.assertEqual(
+                    offset,
+                    len(first_half[: first_half.rindex("\n") + 1].encode("utf-8")),
+                )
+                self.assertEqual(world_id, "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd")
+                self.assertFalse(finished)
+                self.assertEqual(
+                    db.execute(
+                        "SELECT count(*) FROM checkins WHERE end_time IS NULL"
+                    ).fetchone()[0],
+                    1,
+                )
+
+                with open(log_path, mode="a", encoding="utf-8") as log_file:
+                    log_file.write(second_half)
+
+                app.stop_event.clear()
+                app.follow_log_file(log_path, None)
+
+                self.assertEqual(
+                    db.execute("SELECT count(*) FROM checkins").fetchone()[0], 2
+                )
+                self.assertEqual(
+                    [
+                        end
+                        for (world_id, name, start, end) in app.visitors_between()
+                        if name == "Fox"
+                    ],
+                    [parse_log_timestamp("2022.04.05 21:50:02")],
+                )
+                self.assertEqual(
+                    db.execute(
+                        "SELECT count(*) FROM visitors WHERE end_time IS NULL"
+                    ).fetchone()[0],
+                    0,
+                )
+                self.assertEqual(
+                    db.execute("SELECT offset, finished FROM checkpoints").fetchone(),
+                    (len(LOG_FIXTURE.encode("utf-8")), 1),
+                )
+
+    def test_iter_events(self):
+        def at(timestamp):
+            return to_timestamp(parse_log_timestamp(timestamp))
+
+        self.assertEqual(
+            list(iter_events(LOG_FIXTURE.splitlines())),
+            [
+                WorldJoin(
+                    *at("2022.04.05 21:44:16"),
+                    "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                ),
+                WorldName(*at("2022.04.05 21:44:17"), "VRChat Home"),
+                PlayerJoin(*at("2022.04.05 21:44:18"), "KittyHawk"),
+                PlayerJoin(*at("2022.04.05 21:44:20"), "Fox"),
+                PlayerLeave(*at("2022.04.05 21:50:02"), "Fox"),
+                WorldJoin(
+                    *at("2022.04.05 21:55:30"),
+                    "wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399",
+                ),
+                WorldName(*at("2022.04.05 21:55:31"), "Just Rain"),
+                PlayerJoin(*at("2022.04.05 21:55:33"), "KittyHawk"),
+            ],
+        )
+
+    def test_follow_log_file_sinks(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+                feed_path = os.path.join(user_data_dir, "feed.ndjson")
+
+                class BrokenSink(MemorySink):
+                    def handle(self, event):
+                        raise OSError("No space left on device")
+
+                memory = MemorySink()
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.sink_factories = [
+                    lambda path: BrokenSink(),
+                    lambda path: memory,
+                    lambda path: FeedSink(feed_path, path),
+                ]
+                with self.assertLogs(level="ERROR"):
+                    app.follow_log_file(log_path, None)
+
+                # Every sink saw the same events, from one pass over the log,
+                # despite one of them failing
+                self.assertEqual(
+                    memory.events, list(iter_events(LOG_FIXTURE.splitlines()))
+                )
+                self.assertIsNotNone(memory.end)
+
+                with open(feed_path, encoding="utf-8") as feed_file:
+                    feed = [json.loads(line) for line in feed_file]
+                self.assertEqual(
+                    [(record["event"], record["log"]) for record in feed][:2],
+                    [
+                        ("world_join", "output_log_21-44-10.txt"),
+                        ("world_name", "output_log_21-44-10.txt"),
+                    ],
+                )
+                self.assertEqual(
+                    [
+                        (record["time"], record["offset"], record.get("name"))
+                        for record in feed
+                    ],
+                    [
+                        (event.time, event.offset, getattr(event, "name", None))
+                        for event in memory.events
+                    ],
+                )
+
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*), count(end_time) FROM visitors"
+                    ).fetchone(),
+                    (3, 3),
+                )
+                db_conn.close()
+
+    def test_follow_log_file_without_final_newline(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE.rstrip("\n"))
+
+                memory = MemorySink()
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.sink_factories = [lambda path: memory]
+                app.follow_log_file(log_path, None)
+
+                self.assertEqual(
+                    memory.events, list(iter_events(LOG_FIXTURE.splitlines()))
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT offset, finished FROM checkpoints"
+                    ).fetchone(),
+                    (os.path.getsize(log_path), 1),
+                )
+                db_conn.close()
+
+    def test_follow_log_file_twice(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.follow_log_file(log_path, None)
+
+                # Without a checkpoint, everything is read again and finds
+                # the rows which are already there
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.execute("DELETE FROM checkpoints")
+                db_conn.commit()
+                app.follow_log_file(log_path, None)
+
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*), count(end_time) FROM checkins"
+                    ).fetchone(),
+                    (2, 2),
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*), count(end_time) FROM visitors"
+                    ).fetchone(),
+                    (3, 3),
+                )
+
+    def test_checkins_between(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.commit()
+
+                self.assertEqual(
+                    app.checkins_between(
+                        since=parse_date("2022-04-10T00:00:00-07:00"),
+                        until=parse_date("2022-04-15T18:00:00-07:00"),
+                    ),
+                    [
+                        (
+                            "wrld_26120cd6-6097-406e-8a48-a3657cb60511",
+                            "Reflections 2",
+                            parse_date("2022-04-10T18:08:22-07:00"),
+                            parse_date("2022-04-10T18:38:56-07:00"),
+                        ),
+                        (
+                            "wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399",
+                            "Just Rain",
+                            parse_date("2022-04-15T16:09:26-07:00"),
+                            parse_date("2022-04-15T16:10:35-07:00"),
+                        ),
+                        (
+                            "wrld_26120cd6-6097-406e-8a48-a3657cb60511",
+                            "Reflections 2",
+                            parse_date("2022-04-15T16:10:35-07:00"),
+                            parse_date("2022-04-15T16:39:21-07:00"),
+                        ),
+                    ],
+                )
+                self.assertEqual(len(app.checkins_between()), 6)
+                # Times come back as they were written, not in our timezone
+                self.assertEqual(
+                    app.checkins_between()[0][2].isoformat(),
+                    "2022-04-05T21:44:16-07:00",
+                )
+
+    def test_search(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.execute("INSERT INTO players (name) VALUES ('KittyHawk')")
+                db_conn.execute(
+                    "INSERT INTO visitors (world_id, player_id, start_time, start_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 1, strftime('%s', '2022-04-05T23:02:20-07:00'), -420)"
+                )
+                db_conn.commit()
+
+                self.assertEqual(
+                    [
+                        (world_name, start.isoformat())
+                        for (world_id, world_name, start, end, _) in app.search("RAIN")
+                    ],
+                    [
+                        ("Just Rain", "2022-04-15T18:13:51-07:00"),
+                        ("Just Rain", "2022-04-15T16:09:26-07:00"),
+                    ],
+                )
+                self.assertEqual(
+                    app.search("ttyHa"),
+                    [
+                        (
+                            "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                            "VRChat Home",
+                            parse_date("2022-04-05T23:02:13-07:00"),
+                            parse_date("2022-04-05T23:02:28-07:00"),
+                            "KittyHawk",
+                        )
+                    ],
+                )
+
+                # Renamed worlds are found by their new name
+                db_conn.execute(
+                    "UPDATE worlds SET name = 'Just Snow' WHERE name = 'Just Rain'"
+                )
+                db_conn.commit()
+                self.assertEqual(app.search("Rain"), [])
+                self.assertEqual(len(app.search("Snow")), 2)
+
+    def test_stats(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                # Closing the open check-in counts it too
+                db_conn.execute(
+                    "UPDATE checkins SET end_time = start_time + 600, end_offset = start_offset WHERE end_time IS NULL"
+                )
+                db_conn.commit()
+
+                self.assertEqual(
+                    app.top_worlds(2),
+                    [
+                        (
+                            "wrld_26120cd6-6097-406e-8a48-a3657cb60511",
+                            "Reflections 2",
+                            2,
+                            3560,
+                        ),
+                        ("wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e", None, 1, 600),
+                    ],
+                )
+                self.assertEqual(
+                    app.daily_activity(),
+                    [
+                        ("2022-04-15", 3, 1829),
+                        ("2022-04-10", 1, 1834),
+                        ("2022-04-05", 2, 615),
+                    ],
+                )
+
+                # Anything still open at the end of the log closes when it was
+                # last written
+                last_written = parse_log_timestamp("2022.04.05 22:00:00").timestamp()
+                os.utime(log_path, (last_written, last_written))
+
+                app.backfill(paths=[log_path], max_workers=1)
+                self.assertEqual(app.top_players(1), [("KittyHawk", 2, 672 + 267)])
+
+    def test_archive(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                archive_path = os.path.join(user_data_dir, "archive.xz")
+                (name, file, size, mtime, blocks) = archive_log_file(
+                    log_path, archive_path, block_size=300
+                )
+                self.assertEqual(name, "output_log_21-44-10.txt")
+                self.assertEqual(size, len(LOG_FIXTURE.encode("utf-8")))
+                self.assertEqual(len(blocks), 3)
+
+                # Every block starts on a new line, and covers its own times
+                (offset, length, raw_offset, raw_length, start_time, end_time) = blocks[
+                    1
+                ]
+                self.assertEqual(
+                    list(read_archive_lines(archive_path, [(offset, length)])),
+                    LOG_FIXTURE.encode("utf-8")[raw_offset : raw_offset + raw_length]
+                    .decode("utf-8")
+                    .splitlines(),
+                )
+                self.assertEqual(
+                    start_time,
+                    int(parse_log_timestamp("2022.04.05 21:44:18").timestamp()),
+                )
+                self.assertEqual(
+                    end_time,
+                    int(parse_log_timestamp("2022.04.05 21:55:30").timestamp()),
+                )
+
+    def test_reingest(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.archive_block_size = 300
+                app.backfill(paths=[log_path], max_workers=1)
+                self.assertTrue(
+                    os.path.exists(
+                        os.path.join(
+                            user_data_dir, "Archive", "output_log_21-44-10.txt.gz"
+                        )
+                    )
+                )
+                self.assertEqual(app.unarchived([log_path]), [])
+
+                # VRChat has since deleted the log, and the history was lost
+                os.remove(log_path)
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript("DELETE FROM visitors; DELETE FROM checkins;")
+
+                app.reingest(
+                    since=parse_log_timestamp("2022.04.05 21:55:00"), max_workers=1
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT world_id, count(end_time) FROM checkins GROUP BY world_id"
+                    ).fetchall(),
+                    [("wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399", 1)],
+                )
+
+                app.reingest(max_workers=1)
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*), count(end_time) FROM checkins"
+                    ).fetchone(),
+                    (2, 2),
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*), count(end_time) FROM visitors"
+                    ).fetchone(),
+                    (3, 3),
+                )
+
+    def test_backfill_after_maintenance(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                # Rejoining the same world straight away, which maintenance
+                # merges into one check-in
+                (before, after) = LOG_FIXTURE.split("2022.04.05 21:55:30")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(before)
+                    log_file.write(
+                        "2022.04.05 21:50:30 Log        -  [Behaviour] Joining wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd:12345~private(usr_00000000-0000-0000-0000-000000000000)\n"
+                    )
+                    log_file.write("2022.04.05 21:55:30" + after)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.backfill(paths=[log_path], max_workers=1)
+                app.last_active = 0
+                app.visitor_retention = 365
+                results = app.maintain()
+                self.assertEqual(results["merge_checkins"], 1)
+                self.assertEqual(results["visitor_retention"], 3)
+
+                def history():
+                    with app.readers.connection() as db_conn:
+                        return [
+                            db_conn.execute(query).fetchall()
+                            for query in (
+                                "SELECT * FROM checkins ORDER BY id",
+                                "SELECT * FROM visitors ORDER BY id",
+                                "SELECT * FROM world_stats ORDER BY world_id",
+                                "SELECT * FROM player_stats ORDER BY player_id",
+                                "SELECT * FROM daily_stats ORDER BY day",
+                            )
+                        ]
+
+                maintained = history()
+                self.assertEqual(len(maintained[0]), 2)
+                self.assertEqual(maintained[1], [])
+
+                # Reading the same logs again brings back neither the merged
+                # check-in nor the deleted visitors, nor counts them again
+                app.backfill(paths=[log_path], max_workers=1)
+                self.assertEqual(history(), maintained)
+                app.reingest(max_workers=1)
+                self.assertEqual(history(), maintained)
+                app.maintain()
+                self.assertEqual(history(), maintained)
+
+    def test_migrate_legacy_database(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                db_conn = sqlite3.connect(os.path.join(user_data_dir, "WarpTrail.db"))
+                db_conn.executescript(LEGACY_DB_SCHEMA)
+                db_conn.executescript(LEGACY_DB_CHECKIN_FIXTURES)
+                # As written by the OnPlayerLeft handler in older versions
+                db_conn.execute(
+                    "INSERT INTO visitors VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 'Fox', '2022-04-05T23:02:14-07:00', '2022-04-05 23:02:20-07:00')"
+                )
+                # The same moment, written in UTC; only one of them is kept
+                db_conn.execute(
+                    "INSERT INTO checkins VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', '2022-04-06T06:02:13+00:00', '2022-04-06T06:02:28+00:00')"
+                )
+                db_conn.commit()
+                db_conn.close()
+
+                for _ in range(2):
+                    app = WarpTrailApp(
+                        user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                    )
+
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(
+                    db_conn.execute("PRAGMA user_version").fetchone()[0],
+                    len(MIGRATIONS),
+                )
+                self.assertEqual(
+                    app.checkins_between()[1],
+                    (
+                        "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                        "VRChat Home",
+                        parse_date("2022-04-05T23:02:13-07:00"),
+                        parse_date("2022-04-05T23:02:28-07:00"),
+                    ),
+                )
+                self.assertEqual(len(app.checkins_between()), 6)
+                self.assertEqual(
+                    app.visitors_between(),
+                    [
+                        (
+                            "wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                            "Fox",
+                            parse_date("2022-04-05T23:02:14-07:00"),
+                            parse_date("2022-04-05T23:02:20-07:00"),
+                        )
+                    ],
+                )
+
+                plan = db_conn.execute(
+                    "EXPLAIN QUERY PLAN UPDATE checkins SET end_time = 0 WHERE world_id = '' AND end_time IS NULL"
+                ).fetchall()
+                self.assertIn("checkins_open", plan[0][3])
+
+    def test_database_writer(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+
+                writer = DatabaseWriter(app.database_path)
+                writer.start()
+
+                for index in range(1000):
+                    writer.execute(
+                        "INSERT INTO worlds (id) VALUES (?)", ("wrld_{}".format(index),)
+                    )
+                # A failed write shouldn't take the rest of the batch with it
+                writer.execute("INSERT INTO worlds (id) VALUES (NULL)")
+                writer.execute("INSERT INTO worlds (id) VALUES ('wrld_last')")
+
+                # Nor should an operation which fails with something other
+                # than a database error, and what it wrote is undone
+                def broken(db):
+                    db.execute("INSERT INTO worlds (id) VALUES ('wrld_broken')")
+                    raise ValueError("Not a database error")
+
+                with self.assertLogs(level="ERROR"):
+                    writer.submit(broken)
+                    writer.flush()
+                self.assertTrue(writer.thread.is_alive())
+                writer.execute("INSERT INTO worlds (id) VALUES ('wrld_after')")
+                writer.flush()
+
+                # A player added by an operation which was undone mustn't be
+                # remembered, or the next new player would get its ID
+                def broken_player(db):
+                    writer.player_id(db, "Alice")
+                    raise ValueError("Not a database error")
+
+                with self.assertLogs(level="ERROR"):
+                    writer.submit(broken_player)
+                    writer.flush()
+                writer.submit(lambda db: writer.player_id(db, "Bob"))
+                writer.submit(lambda db: writer.player_id(db, "Alice"))
+                writer.flush()
+
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(
+                    db_conn.execute("SELECT count(*) FROM worlds").fetchone()[0], 1002
+                )
+                self.assertEqual(
+                    db_conn.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT id, name FROM players ORDER BY id"
+                    ).fetchall(),
+                    [(1, "Bob"), (2, "Alice")],
+                )
+
+                writer.stop()
+                self.assertFalse(writer.thread.is_alive())
+
+    def test_export_job(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.commit()
+
+                json_path = os.path.join(user_data_dir, "history.json")
+                progress = []
+                done = []
+                job = ExportJob(
+                    app,
+                    json_path,
+                    on_progress=lambda job: progress.append((job.written, job.total)),
+                    on_done=done.append,
+                    incremental=True,
+                )
+                job.start()
+                job.thread.join()
+
+                self.assertEqual(done, [job])
+                self.assertIsNone(job.error)
+                self.assertEqual(progress, [(0, 6), (6, 6)])
+                with open(json_path, mode="rb") as json_file:
+                    exported = json_file.read()
+
+                # Cancelling part way through adding to an export leaves the
+                # file as it was
+                db_conn.execute(
+                    "INSERT INTO checkins (world_id, start_time, start_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 0, 0)"
+                )
+                db_conn.commit()
+                job = ExportJob(app, json_path, incremental=True)
+                job.cancel()
+                job.start()
+                job.thread.join()
+
+                self.assertIsNone(job.error)
+                with open(json_path, mode="rb") as json_file:
+                    self.assertEqual(json_file.read(), exported)
+
+                # Or, for a new export, doesn't leave one at all
+                markdown_path = os.path.join(user_data_dir, "history.md")
+                job = ExportJob(app, markdown_path)
+                job.cancel()
+                job.start()
+                job.thread.join()
+                self.assertFalse(os.path.exists(markdown_path))
+                self.assertFalse(os.path.exists(markdown_path + ".tmp"))
+
+                # And starting one over leaves the last one in place
+                job = ExportJob(app, json_path)
+                job.cancel()
+                job.start()
+                job.thread.join()
+                with open(json_path, mode="rb") as json_file:
+                    self.assertEqual(json_file.read(), exported)
+
+    def test_reader_pool(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.close()
+
+                with app.readers.connection() as reader:
+                    with self.assertRaises(sqlite3.OperationalError):
+                        reader.execute("DELETE FROM checkins")
+
+                with app.readers.connection() as reader:
+                    # A long read keeps its snapshot, and doesn't hold up the
+                    # writer while it's going
+                    reader.execute("BEGIN")
+                    (before,) = reader.execute(
+                        "SELECT count(*) FROM checkins"
+                    ).fetchone()
+                    app.writer.execute(
+                        "UPDATE checkins SET end_time = start_time WHERE end_time IS NULL"
+                    )
+                    app.writer.execute(
+                        "INSERT INTO checkins (world_id, start_time, start_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', 0, 0)"
+                    )
+                    app.writer.flush()
+                    self.assertEqual(
+                        reader.execute("SELECT count(*) FROM checkins").fetchone(),
+                        (before,),
+                    )
+
+                # Handed back without its snapshot, for the next reader
+                with app.readers.connection() as next_reader:
+                    self.assertIs(next_reader, reader)
+                    self.assertEqual(
+                        next_reader.execute("SELECT count(*) FROM checkins").fetchone(),
+                        (before + 1,),
+                    )
+
+                    with app.readers.connection() as other_reader:
+                        self.assertIsNot(other_reader, reader)
+
+                app.readers.close()
+                self.assertTrue(app.readers.idle.empty())
+
+    def test_maintain(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.executescript(
+                    """
+                    INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', strftime('%s', '2022-04-15T16:39:50-07:00'), -420, strftime('%s', '2022-04-15T17:00:00-07:00'), -420);
+                    INSERT INTO "players" (name) VALUES ('Kitten'), ('Puppy');
+                    INSERT INTO "visitors" (world_id, player_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e', 1, strftime('%s', '2022-04-05T21:50:00-07:00'), -420, NULL, NULL);
+                    INSERT INTO "visitors" (world_id, player_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_26120cd6-6097-406e-8a48-a3657cb60511', 2, strftime('%s', '2022-04-15T16:20:00-07:00'), -420, strftime('%s', '2022-04-15T16:30:00-07:00'), -420);
+                    """
+                )
+                db_conn.close()
+
+                app.last_active = 0
+                self.assertTrue(app.maintenance_due())
+
+                app.visitor_retention = 365
+                results = app.maintain()
+                self.assertEqual(results["merge_checkins"], 1)
+                self.assertEqual(results["visitor_retention"], 2)
+                self.assertGreaterEqual(results["vacuum"], 0)
+                self.assertFalse(app.maintenance_due())
+
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(db_conn.execute("PRAGMA auto_vacuum").fetchone(), (2,))
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT count(*) FROM checkins WHERE end_time IS NULL"
+                    ).fetchone(),
+                    (0,),
+                )
+                self.assertEqual(
+                    db_conn.execute("SELECT count(*) FROM visitors").fetchone(),
+                    (0,),
+                )
+
+                # The orphaned check-in ends when the next one starts
+                self.assertEqual(
+                    app.checkins_between()[0][3],
+                    parse_date("2022-04-05T23:02:13-07:00"),
+                )
+
+                # The merged check-in covers both, and the statistics agree
+                self.assertEqual(
+                    [
+                        (start.isoformat(), end.isoformat())
+                        for (world_id, _, start, end) in app.checkins_between()
+                        if world_id == "wrld_26120cd6-6097-406e-8a48-a3657cb60511"
+                    ],
+                    [
+                        ("2022-04-10T18:08:22-07:00", "2022-04-10T18:38:56-07:00"),
+                        ("2022-04-15T16:10:35-07:00", "2022-04-15T17:00:00-07:00"),
+                    ],
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT world_id, visits, seconds FROM world_stats ORDER BY world_id"
+                    ).fetchall(),
+                    db_conn.execute(
+                        "SELECT world_id, count(*), sum(end_time - start_time) FROM checkins GROUP BY world_id ORDER BY world_id"
+                    ).fetchall(),
+                )
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT day, checkins, seconds FROM daily_stats ORDER BY day"
+                    ).fetchall(),
+                    db_conn.execute(
+                        "SELECT date(start_time + start_offset * 60, 'unixepoch'), count(*), sum(end_time - start_time) FROM checkins GROUP BY 1 ORDER BY 1"
+                    ).fetchall(),
+                )
+                db_conn.close()
+
+                # Still searchable after the full VACUUM
+                self.assertEqual(len(app.search("Reflect")), 2)
+
+    def test_log_followers(self):
+        release = ThreadingEvent()
+        followed = []
+
+        def follow(path, responsible_process):
+            followed.append(path)
+            release.wait(5)
+
+        followers = LogFollowers(follow, max_workers=1)
+        self.assertTrue(followers.start("output_log_1.txt", None))
+        self.assertFalse(followers.start("output_log_1.txt", None))
+        # Waits for a free thread, rather than starting another
+        self.assertTrue(followers.start("output_log_2.txt", None))
+        self.assertEqual(len(followers.active), 2)
+
+        release.set()
+        followers.executor.shutdown(wait=True)
+        self.assertEqual(len(followed), 2)
+        self.assertEqual(followers.active, {})
+
+        # Once a follower has finished, the same log can be followed again
+        followers.stop()
+        self.assertTrue(followers.start("output_log_1.txt", None))
+        followers.stop(wait=True)
+
+    def test_watch_log_files_waits_for_followers(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                following = ThreadingEvent()
+                closed = []
+
+                class SlowSink(MemorySink):
+                    def handle(self, event):
+                        super().handle(event)
+                        following.set()
+
+                    def close(self, end=None):
+                        # Shutting down mustn't leave this behind
+                        time.sleep(0.2)
+                        closed.append(end)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.watch_stopped = ThreadingEvent()
+                app.sink_factories = [lambda path: SlowSink()]
+                app.vrchat_processes = FakeVRChatProcesses(
+                    [FakeProcess(1, log_created_time(log_path))]
+                )
+
+                watcher = Thread(target=app.watch_log_files)
+                watcher.start()
+                self.assertTrue(following.wait(5))
+                app.stop()
+                watcher.join(5)
+
+                self.assertFalse(watcher.is_alive())
+                self.assertTrue(app.watch_stopped.is_set())
+                self.assertEqual(closed, [None])
+                self.assertEqual(app.followers.active, {})
+
+                # VRChat's still running, so the log is picked up again from
+                # where we stopped
+                db_conn = sqlite3.connect(app.database_path)
+                self.assertEqual(
+                    db_conn.execute(
+                        "SELECT offset, finished FROM checkpoints WHERE path = ?",
+                        (log_path,),
+                    ).fetchone(),
+                    (os.path.getsize(log_path), 0),
+                )
+                db_conn.close()
+
+    def test_vrchat_processes(self):
+        first = FakeProcess(1, created=1000)
+        processes = FakeVRChatProcesses([first])
+
+        self.assertIs(processes.find(created=1001), first)
+        self.assertIs(processes.find(created=1002), first)
+        self.assertEqual(processes.scans, 1)
+
+        # A log created well after every known client started means there's
+        # a new one
+        second = FakeProcess(2, created=5000)
+        processes.processes.append(second)
+        self.assertIs(processes.find(created=5001), second)
+        self.assertIs(processes.find(created=1003), first)
+        self.assertEqual(processes.scans, 2)
+
+        first.running = second.running = False
+        processes.processes = []
+        self.assertIsNone(processes.find())
+
+    def test_metrics(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                log_path = os.path.join(vrchat_data_dir, "output_log_21-44-10.txt")
+                with open(log_path, mode="w", encoding="utf-8") as log_file:
+                    log_file.write(LOG_FIXTURE)
+
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                app.stop_event = ThreadingEvent()
+                app.metrics.profiling = True
+                app.follow_log_file(log_path, None)
+
+                snapshot = app.metrics.snapshot()
+                self.assertEqual(snapshot["counters"]["lines_read_total"], 9)
+                self.assertEqual(
+                    snapshot["counters"]['lines_matched_total{kind="player_join"}'], 3
+                )
+                self.assertEqual(
+                    snapshot["counters"]['lines_matched_total{kind="world_join"}'], 2
+                )
+                self.assertEqual(
+                    snapshot["gauges"][
+                        'tail_lag_bytes{file="output_log_21-44-10.txt"}'
+                    ],
+                    0,
+                )
+                self.assertGreater(
+                    snapshot["histograms"]['stage_seconds{stage="commit"}']["count"], 0
+                )
+                self.assertEqual(
+                    len(glob.glob(os.path.join(user_data_dir, "WarpTrail-*.prof"))), 1
+                )
+
+                summary = app.metrics.format_summary()
+                self.assertTrue(summary.startswith("Running for 0h 00m\n"))
+                self.assertIn("\nlines_read_total: 9\n", summary)
+                self.assertTrue(summary.endswith("\nProfiling: on"))
+
+                server = serve_metrics(app.metrics, 0)
+                try:
+                    with urlopen(
+                        "http://127.0.0.1:{}/metrics".format(server.server_port)
+                    ) as response:
+                        body = response.read().decode("utf-8")
+                finally:
+                    server.shutdown()
+                    server.server_close()
+
+                self.assertIn("# TYPE warptrail_lines_read_total counter\n", body)
+                self.assertIn(
+                    'warptrail_stage_seconds_bucket{stage="read",le="+Inf"} 1\n', body
+                )
+
     def test_format_as_markdown(self):
         with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
             with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
@@ -124,6 +1279,239 @@ Reflections 2 (https://vrch.at/wrld_26120cd6-6097-406e-8a48-a3657cb60511), from
                     '[{"world_name":null,"world_url":"https://vrch.at/wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e","start_datetime":"2022-04-05T21:44:16-07:00","end_datetime":null},{"world_name":"VRChat Home","world_url":"https://vrch.at/wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd","start_datetime":"2022-04-05T23:02:13-07:00","end_datetime":"2022-04-05T23:02:28-07:00"},{"world_name":"Reflections 2","world_url":"https://vrch.at/wrld_26120cd6-6097-406e-8a48-a3657cb60511","start_datetime":"2022-04-10T18:08:22-07:00","end_datetime":"2022-04-10T18:38:56-07:00"},{"world_name":"Just Rain","world_url":"https://vrch.at/wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399","start_datetime":"2022-04-15T16:09:26-07:00","end_datetime":"2022-04-15T16:10:35-07:00"},{"world_name":"Just Rain","world_url":"https://vrch.at/wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399","start_datetime":"2022-04-15T18:13:51-07:00","end_datetime":"2022-04-15T18:14:25-07:00"},{"world_name":"Reflections 2","world_url":"https://vrch.at/wrld_26120cd6-6097-406e-8a48-a3657cb60511","start_datetime":"2022-04-15T16:10:35-07:00","end_datetime":"2022-04-15T16:39:21-07:00"}]',
                 )
 
+    def test_format_as_since_until(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.commit()
+
+                file = io.StringIO("")
+                app.format_as(
+                    ".txt",
+                    file,
+                    since=parse_date("2022-04-10T00:00:00-07:00"),
+                    until=parse_date("2022-04-15T17:00:00-07:00"),
+                )
+
+                self.assertEqual(
+                    file.getvalue(),
+                    """Reflections 2 (https://vrch.at/wrld_26120cd6-6097-406e-8a48-a3657cb60511), from 10/04/2022, 18:08 until 10/04/2022, 18:38
+Just Rain (https://vrch.at/wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399), from 15/04/2022, 16:09 until 15/04/2022, 16:10
+Reflections 2 (https://vrch.at/wrld_26120cd6-6097-406e-8a48-a3657cb60511), from 15/04/2022, 16:10 until 15/04/2022, 16:39
+""",
+                )
+
+    def test_format_as_csv_ndjson(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.executescript(
+                    """
+                    INSERT INTO "players" (name) VALUES ('Fox "the" Fox');
+                    INSERT INTO "visitors" (world_id, player_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', 1, strftime('%s', '2022-04-15T16:09:30-07:00'), -420, strftime('%s', '2022-04-15T16:10:00-07:00'), -420);
+                    """
+                )
+                db_conn.close()
+
+                file = io.StringIO("")
+                app.format_as(
+                    ".csv",
+                    file,
+                    since=parse_date("2022-04-15T00:00:00-07:00"),
+                    visitors=True,
+                )
+                self.assertEqual(
+                    file.getvalue(),
+                    """kind,world_id,world_name,player_name,start_datetime,end_datetime
+checkin,"wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399","Just Rain",,"2022-04-15T16:09:26-07:00","2022-04-15T16:10:35-07:00"
+checkin,"wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399","Just Rain",,"2022-04-15T18:13:51-07:00","2022-04-15T18:14:25-07:00"
+checkin,"wrld_26120cd6-6097-406e-8a48-a3657cb60511","Reflections 2",,"2022-04-15T16:10:35-07:00","2022-04-15T16:39:21-07:00"
+visitor,"wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399","Just Rain","Fox ""the"" Fox","2022-04-15T16:09:30-07:00","2022-04-15T16:10:00-07:00"
+""",
+                )
+
+                file = io.StringIO("")
+                app.format_as(".ndjson", file, visitors=True)
+                lines = [json.loads(line) for line in file.getvalue().splitlines()]
+                self.assertEqual(len(lines), 7)
+                self.assertEqual(
+                    lines[0],
+                    {
+                        "kind": "checkin",
+                        "world_name": None,
+                        "world_url": "https://vrch.at/wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e",
+                        "start_datetime": "2022-04-05T21:44:16-07:00",
+                        "end_datetime": None,
+                    },
+                )
+                self.assertEqual(lines[6]["kind"], "visitor")
+                self.assertEqual(lines[6]["player_name"], 'Fox "the" Fox')
+
+                with self.assertRaises(ValueError):
+                    app.format_as(".md", io.StringIO(""), visitors=True)
+
+    def test_export_parts(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.close()
+
+                file = io.StringIO("")
+                app.format_as(".csv", file)
+                (header, *lines) = file.getvalue().splitlines(keepends=True)
+
+                # A stale part from an earlier, bigger export
+                csv_path = os.path.join(user_data_dir, "history.csv")
+                with open(csv_path[:-4] + "-0009.csv", mode="w") as stale_file:
+                    stale_file.write(header)
+
+                # Room for the header and two rows per part
+                max_bytes = len(header) + 2 * max(len(line) for line in lines)
+                paths = app.export(csv_path, max_bytes=max_bytes)
+
+                self.assertEqual(
+                    [os.path.basename(path) for path in paths],
+                    ["history-0001.csv", "history-0002.csv", "history-0003.csv"],
+                )
+                self.assertEqual(
+                    sorted(glob.glob(os.path.join(user_data_dir, "history*.csv"))),
+                    paths,
+                )
+
+                parts = []
+                for path in paths:
+                    self.assertLessEqual(os.path.getsize(path), max_bytes)
+                    with open(path, encoding="utf-8") as part_file:
+                        (part_header, *part_lines) = part_file.readlines()
+                    self.assertEqual(part_header, header)
+                    parts.extend(part_lines)
+                self.assertEqual(parts, lines)
+
+                with self.assertRaises(ValueError):
+                    app.export(
+                        os.path.join(user_data_dir, "history.json"), max_bytes=1000
+                    )
+
+    def test_export_incremental(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                db_conn.commit()
+
+                json_path = os.path.join(user_data_dir, "history.json")
+                markdown_path = os.path.join(user_data_dir, "history.md")
+                for path in (json_path, markdown_path):
+                    app.export(path, incremental=True)
+
+                # The open check-in closes, and a new one starts
+                db_conn.executescript(
+                    """
+                    UPDATE checkins SET end_time = strftime('%s', '2022-04-05T22:00:00-07:00'), end_offset = -420 WHERE end_time IS NULL;
+                    INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', strftime('%s', '2022-04-16T10:00:00-07:00'), -420, NULL, NULL);
+                    """
+                )
+                for path in (json_path, markdown_path):
+                    app.export(path, incremental=True)
+                # Nothing new this time
+                app.export(json_path, incremental=True)
+
+                with open(json_path, encoding="utf-8") as json_file:
+                    exported = json.load(json_file)
+                self.assertEqual(len(exported), 8)
+                self.assertEqual(
+                    exported[6:],
+                    [
+                        {
+                            "world_name": None,
+                            "world_url": "https://vrch.at/wrld_47c2a8bd-1f76-4e2c-94bb-5ae3b43e762e",
+                            "start_datetime": "2022-04-05T21:44:16-07:00",
+                            "end_datetime": "2022-04-05T22:00:00-07:00",
+                        },
+                        {
+                            "world_name": "VRChat Home",
+                            "world_url": "https://vrch.at/wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd",
+                            "start_datetime": "2022-04-16T10:00:00-07:00",
+                            "end_datetime": None,
+                        },
+                    ],
+                )
+
+                with open(markdown_path, encoding="utf-8") as markdown_file:
+                    markdown = markdown_file.read()
+                self.assertEqual(markdown.count("# WarpTrail Location History"), 1)
+                self.assertTrue(
+                    markdown.endswith(
+                        """  from 05/04/2022, 21:44 until 05/04/2022, 22:00
+- [VRChat Home](https://vrch.at/wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd)  
+  from 16/04/2022, 10:00 until (unknown)
+"""
+                    )
+                )
+
+                # Without --incremental, the file starts over
+                app.export(json_path)
+                with open(json_path, encoding="utf-8") as json_file:
+                    self.assertEqual(len(json.load(json_file)), 7)
+
+    def test_export_incremental_after_maintenance(self):
+        with TemporaryDirectory(ignore_cleanup_errors=True) as vrchat_data_dir:
+            with TemporaryDirectory(ignore_cleanup_errors=True) as user_data_dir:
+                app = WarpTrailApp(
+                    user_data_dir=user_data_dir, vrchat_data_dir=vrchat_data_dir
+                )
+                db_conn = sqlite3.connect(app.database_path)
+                db_conn.executescript(DB_CHECKIN_FIXTURES)
+                # Rejoining straight away; maintenance merges this, the newest
+                # check-in, into the one before
+                db_conn.executescript(
+                    """
+                    INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_56b348fc-b1cb-4242-8587-9eb8e01ef399', strftime('%s', '2022-04-15T18:14:40-07:00'), -420, strftime('%s', '2022-04-15T18:20:00-07:00'), -420);
+                    """
+                )
+                db_conn.commit()
+
+                json_path = os.path.join(user_data_dir, "history.json")
+                app.export(json_path, incremental=True)
+
+                app.last_active = 0
+                self.assertEqual(app.maintain()["merge_checkins"], 1)
+
+                db_conn.executescript(
+                    """
+                    INSERT INTO "checkins" (world_id, start_time, start_offset, end_time, end_offset) VALUES ('wrld_4432ea9b-729c-46e3-8eaf-846aa0a37fdd', strftime('%s', '2022-04-16T10:00:00-07:00'), -420, NULL, NULL);
+                    """
+                )
+                db_conn.close()
+                app.export(json_path, incremental=True)
+
+                with open(json_path, encoding="utf-8") as json_file:
+                    exported = json.load(json_file)
+                self.assertEqual(
+                    exported[-1]["start_datetime"], "2022-04-16T10:00:00-07:00"
+                )
+                # The check-in the merged one was folded into is written again,
+                # now it ends later
+                self.assertEqual(
+                    (exported[-2]["start_datetime"], exported[-2]["end_datetime"]),
+                    ("2022-04-15T18:13:51-07:00", "2022-04-15T18:20:00-07:00"),
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,158 +1,2779 @@
 #!/usr/bin/env python
 
+import argparse
+import cProfile
+import glob
+import gzip
+import json
+import multiprocessing
 import os
 import time
 import logging
+import lzma
 import sqlite3
 import sys
 import re
+import signal
 
 from appdirs import AppDirs
-from datetime import datetime
-from dateutil.parser import parse as parse_date
-from dateutil.utils import default_tzinfo
-from dateutil.tz import gettz
-from PIL import Image
-import psutil
-import pystray
-from threading import Thread, Event as ThreadingEvent
-from tkinter import filedialog, messagebox
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from queue import Empty, Full, LifoQueue, Queue
+from threading import Lock, Thread, current_thread, Event as ThreadingEvent
+
+# dateutil, psutil, watchdog, the GUI (tkinter, PIL and pystray) and anything
+# only one command uses are imported where they're needed, so the command line
+# and headless mode start quickly
 
 APP_EMBEDDED = getattr(sys, "frozen", False)
 
-DB_SCHEMA = """
-PRAGMA foreign_keys = ON;
 
-CREATE TABLE IF NOT EXISTS worlds (
-    id TEXT NOT NULL PRIMARY KEY,
-    name TEXT
-);
+def migrate_to_integer_timestamps(db_conn):
+    from dateutil.parser import parse as parse_date
+    from dateutil.utils import default_tzinfo
 
-CREATE TABLE IF NOT EXISTS checkins (
-    world_id TEXT NOT NULL,
-    start_datetime TEXT NOT NULL,
-    end_datetime TEXT,
-    FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
-);
+    def convert(value):
+        # Older versions didn't always write these consistently
+        try:
+            return to_timestamp(default_tzinfo(parse_date(value), local_tz()))
+        except (TypeError, ValueError, OverflowError):
+            return (None, None)
+
+    def convert_rows(rows):
+        # Rows without a usable start time are dropped
+        for (*values, start_datetime, end_datetime) in rows:
+            start = convert(start_datetime)
+            if start[0] is not None:
+                yield (*values, *start, *convert(end_datetime))
+
+    # The same moment may have been written in different ways, so the new
+    # unique indexes have to be there before copying, for OR IGNORE to skip
+    # the duplicates. The old ones have the same names
+    db_conn.execute("DROP INDEX IF EXISTS checkins_world_id_time_unique")
+    db_conn.execute("DROP INDEX IF EXISTS visitors_world_id_name_time_unique")
+
+    db_conn.execute(
+        """
+        CREATE TABLE checkins_new (
+            id INTEGER PRIMARY KEY,
+            world_id TEXT NOT NULL,
+            start_time INTEGER NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_time INTEGER,
+            end_offset INTEGER,
+            FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+        )
+        """
+    )
+    db_conn.execute(
+        "CREATE UNIQUE INDEX checkins_world_id_time_unique ON checkins_new(world_id, start_time)"
+    )
+    db_conn.executemany(
+        "INSERT OR IGNORE INTO checkins_new (world_id, start_time, start_offset, end_time, end_offset) VALUES (?, ?, ?, ?, ?)",
+        convert_rows(
+            db_conn.cursor().execute(
+                "SELECT world_id, start_datetime, end_datetime FROM checkins ORDER BY rowid"
+            )
+        ),
+    )
+
+    db_conn.execute(
+        """
+        CREATE TABLE visitors_new (
+            id INTEGER PRIMARY KEY,
+            world_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            start_time INTEGER NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_time INTEGER,
+            end_offset INTEGER,
+            FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+        )
+        """
+    )
+    db_conn.execute(
+        "CREATE UNIQUE INDEX visitors_world_id_name_time_unique ON visitors_new(world_id, name, start_time)"
+    )
+    db_conn.executemany(
+        "INSERT OR IGNORE INTO visitors_new (world_id, name, start_time, start_offset, end_time, end_offset) VALUES (?, ?, ?, ?, ?, ?)",
+        convert_rows(
+            db_conn.cursor().execute(
+                "SELECT world_id, name, start_datetime, end_datetime FROM visitors ORDER BY rowid"
+            )
+        ),
+    )
+
+    for statement in [
+        "DROP TABLE checkins",
+        "ALTER TABLE checkins_new RENAME TO checkins",
+        "CREATE INDEX checkins_open ON checkins(world_id) WHERE end_time IS NULL",
+        "CREATE INDEX checkins_start_time ON checkins(start_time)",
+        "DROP TABLE visitors",
+        "ALTER TABLE visitors_new RENAME TO visitors",
+        "CREATE INDEX visitors_open ON visitors(world_id, name) WHERE end_time IS NULL",
+        "CREATE INDEX visitors_start_time ON visitors(start_time)",
+    ]:
+        db_conn.execute(statement)
+
+
+# Each entry upgrades the database by one version, either as a SQL script or
+# a function which is handed the connection. PRAGMA user_version records how
+# many have been applied, so add new entries to the end and never edit old ones.
+MIGRATIONS = [
+    # The original schema. Databases from before user_version was tracked
+    # already have these, hence IF NOT EXISTS throughout
+    """
+    CREATE TABLE IF NOT EXISTS worlds (
+        id TEXT NOT NULL PRIMARY KEY,
+        name TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS checkins (
+        world_id TEXT NOT NULL,
+        start_datetime TEXT NOT NULL,
+        end_datetime TEXT,
+        FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS checkins_world_id_time_unique ON checkins(world_id, start_datetime);
+
+    CREATE TABLE IF NOT EXISTS visitors (
+        world_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        start_datetime TEXT NOT NULL,
+        end_datetime TEXT,
+        FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS visitors_world_id_name_time_unique ON visitors(world_id, name, start_datetime);
+    """,
+    # How far into each log we've got, and what we knew at that point, so that
+    # following a log again can pick up where we left off
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        path TEXT NOT NULL PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        world_id TEXT,
+        visitors TEXT,
+        finished INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # Closing sessions only ever looks at the open ones, so those get small
+    # indexes of their own; exports are ordered and filtered by start time
+    """
+    CREATE INDEX checkins_open ON checkins(world_id) WHERE end_datetime IS NULL;
+    CREATE INDEX visitors_open ON visitors(world_id, name) WHERE end_datetime IS NULL;
+    CREATE INDEX checkins_start_datetime ON checkins(start_datetime);
+    """,
+    # Times as seconds since the epoch rather than ISO 8601 text
+    migrate_to_integer_timestamps,
+    # Each player's name is stored once, and visitors refer to it by ID
+    """
+    CREATE TABLE players (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+
+    INSERT INTO players (name)
+    SELECT name FROM visitors GROUP BY name ORDER BY min(id);
+
+    CREATE TABLE visitors_new (
+        id INTEGER PRIMARY KEY,
+        world_id TEXT NOT NULL,
+        player_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        start_offset INTEGER NOT NULL,
+        end_time INTEGER,
+        end_offset INTEGER,
+        FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE,
+        FOREIGN KEY(player_id) REFERENCES players(id) ON DELETE CASCADE
+    );
+
+    INSERT INTO visitors_new (id, world_id, player_id, start_time, start_offset, end_time, end_offset)
+    SELECT visitors.id, visitors.world_id, players.id, visitors.start_time, visitors.start_offset, visitors.end_time, visitors.end_offset
+    FROM visitors
+    INNER JOIN players
+    ON visitors.name = players.name;
+
+    DROP TABLE visitors;
+    ALTER TABLE visitors_new RENAME TO visitors;
+
+    CREATE UNIQUE INDEX visitors_world_id_player_id_time_unique ON visitors(world_id, player_id, start_time);
+    CREATE INDEX visitors_open ON visitors(world_id, player_id) WHERE end_time IS NULL;
+    CREATE INDEX visitors_start_time ON visitors(start_time);
+    CREATE INDEX visitors_player_id ON visitors(player_id);
+    """,
+    # Running totals, kept up to date by triggers as sessions are closed, so
+    # statistics never need to look through the whole history
+    """
+    CREATE TABLE world_stats (
+        world_id TEXT NOT NULL PRIMARY KEY,
+        visits INTEGER NOT NULL,
+        seconds INTEGER NOT NULL,
+        FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+    );
+    CREATE INDEX world_stats_seconds ON world_stats(seconds);
+
+    CREATE TABLE player_stats (
+        player_id INTEGER NOT NULL PRIMARY KEY,
+        encounters INTEGER NOT NULL,
+        seconds INTEGER NOT NULL,
+        FOREIGN KEY(player_id) REFERENCES players(id) ON DELETE CASCADE
+    );
+    CREATE INDEX player_stats_encounters ON player_stats(encounters);
+
+    -- Keyed by the local date each check-in started on
+    CREATE TABLE daily_stats (
+        day TEXT NOT NULL PRIMARY KEY,
+        checkins INTEGER NOT NULL,
+        seconds INTEGER NOT NULL
+    );
+
+    INSERT INTO world_stats (world_id, visits, seconds)
+    SELECT world_id, count(*), sum(max(end_time - start_time, 0))
+    FROM checkins
+    WHERE end_time IS NOT NULL
+    GROUP BY world_id;
+
+    INSERT INTO player_stats (player_id, encounters, seconds)
+    SELECT player_id, count(*), sum(max(end_time - start_time, 0))
+    FROM visitors
+    WHERE end_time IS NOT NULL
+    GROUP BY player_id;
+
+    INSERT INTO daily_stats (day, checkins, seconds)
+    SELECT date(start_time + start_offset * 60, 'unixepoch'), count(*), sum(max(end_time - start_time, 0))
+    FROM checkins
+    WHERE end_time IS NOT NULL
+    GROUP BY 1;
+
+    CREATE TRIGGER checkins_closed AFTER UPDATE OF end_time ON checkins
+    WHEN OLD.end_time IS NULL AND NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO world_stats (world_id, visits, seconds)
+        VALUES (NEW.world_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(world_id) DO UPDATE SET visits = visits + 1, seconds = seconds + excluded.seconds;
+
+        INSERT INTO daily_stats (day, checkins, seconds)
+        VALUES (date(NEW.start_time + NEW.start_offset * 60, 'unixepoch'), 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(day) DO UPDATE SET checkins = checkins + 1, seconds = seconds + excluded.seconds;
+    END;
+
+    -- Backfilled check-ins arrive already closed
+    CREATE TRIGGER checkins_inserted_closed AFTER INSERT ON checkins
+    WHEN NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO world_stats (world_id, visits, seconds)
+        VALUES (NEW.world_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(world_id) DO UPDATE SET visits = visits + 1, seconds = seconds + excluded.seconds;
+
+        INSERT INTO daily_stats (day, checkins, seconds)
+        VALUES (date(NEW.start_time + NEW.start_offset * 60, 'unixepoch'), 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(day) DO UPDATE SET checkins = checkins + 1, seconds = seconds + excluded.seconds;
+    END;
+
+    CREATE TRIGGER visitors_closed AFTER UPDATE OF end_time ON visitors
+    WHEN OLD.end_time IS NULL AND NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO player_stats (player_id, encounters, seconds)
+        VALUES (NEW.player_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(player_id) DO UPDATE SET encounters = encounters + 1, seconds = seconds + excluded.seconds;
+    END;
+
+    CREATE TRIGGER visitors_inserted_closed AFTER INSERT ON visitors
+    WHEN NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO player_stats (player_id, encounters, seconds)
+        VALUES (NEW.player_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(player_id) DO UPDATE SET encounters = encounters + 1, seconds = seconds + excluded.seconds;
+    END;
+    """,
+    # Full text indexes over world and player names, kept in step by
+    # triggers. The trigram tokenizer matches any part of a name, not just
+    # whole words. worlds has no INTEGER PRIMARY KEY, so worlds_search must be
+    # rebuilt after a full VACUUM, which may renumber its rows
+    """
+    CREATE VIRTUAL TABLE worlds_search USING fts5(name, content='worlds', tokenize='trigram');
+    INSERT INTO worlds_search (worlds_search) VALUES ('rebuild');
+
+    CREATE TRIGGER worlds_search_insert AFTER INSERT ON worlds BEGIN
+        INSERT INTO worlds_search (rowid, name) VALUES (NEW.rowid, NEW.name);
+    END;
+    CREATE TRIGGER worlds_search_delete AFTER DELETE ON worlds BEGIN
+        INSERT INTO worlds_search (worlds_search, rowid, name) VALUES ('delete', OLD.rowid, OLD.name);
+    END;
+    CREATE TRIGGER worlds_search_update AFTER UPDATE OF name ON worlds BEGIN
+        INSERT INTO worlds_search (worlds_search, rowid, name) VALUES ('delete', OLD.rowid, OLD.name);
+        INSERT INTO worlds_search (rowid, name) VALUES (NEW.rowid, NEW.name);
+    END;
+
+    CREATE VIRTUAL TABLE players_search USING fts5(name, content='players', content_rowid='id', tokenize='trigram');
+    INSERT INTO players_search (players_search) VALUES ('rebuild');
+
+    CREATE TRIGGER players_search_insert AFTER INSERT ON players BEGIN
+        INSERT INTO players_search (rowid, name) VALUES (NEW.id, NEW.name);
+    END;
+    CREATE TRIGGER players_search_delete AFTER DELETE ON players BEGIN
+        INSERT INTO players_search (players_search, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    END;
+    """,
+    # Compressed copies of finished logs. Each block of an archive is
+    # compressed on its own, so any one can be read back without the rest
+    """
+    CREATE TABLE archives (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        file TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL
+    );
+
+    CREATE TABLE archive_blocks (
+        archive_id INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        raw_offset INTEGER NOT NULL,
+        raw_length INTEGER NOT NULL,
+        start_time INTEGER,
+        end_time INTEGER,
+        PRIMARY KEY (archive_id, offset),
+        FOREIGN KEY(archive_id) REFERENCES archives(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    CREATE INDEX archive_blocks_start_time ON archive_blocks(start_time);
+    """,
+    # Where each file exported with --incremental left off: the newest
+    # check-in in it, and those which were still open (and so will need
+    # writing again once they close)
+    """
+    CREATE TABLE exports (
+        path TEXT NOT NULL PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        open_ids TEXT NOT NULL,
+        size INTEGER NOT NULL
+    );
+    """,
+    # When each maintenance task last ran, and how much it did
+    """
+    CREATE TABLE maintenance (
+        task TEXT NOT NULL PRIMARY KEY,
+        last_run INTEGER NOT NULL,
+        changes INTEGER NOT NULL
+    );
+    """,
+    # Incremental exports remember the newest check-in they've written, so
+    # an ID freed by merging check-ins must never be handed out again
+    """
+    CREATE TABLE checkins_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        world_id TEXT NOT NULL,
+        start_time INTEGER NOT NULL,
+        start_offset INTEGER NOT NULL,
+        end_time INTEGER,
+        end_offset INTEGER,
+        FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
+    );
+
+    INSERT INTO checkins_new (id, world_id, start_time, start_offset, end_time, end_offset)
+    SELECT id, world_id, start_time, start_offset, end_time, end_offset FROM checkins;
+
+    DROP TABLE checkins;
+    ALTER TABLE checkins_new RENAME TO checkins;
+
+    -- The newest check-in may already have been merged away
+    DELETE FROM sqlite_sequence WHERE name = 'checkins';
+    INSERT INTO sqlite_sequence (name, seq)
+    SELECT 'checkins', max((SELECT coalesce(max(id), 0) FROM checkins), (SELECT coalesce(max(last_id), 0) FROM exports));
+
+    CREATE UNIQUE INDEX checkins_world_id_time_unique ON checkins(world_id, start_time);
+    CREATE INDEX checkins_open ON checkins(world_id) WHERE end_time IS NULL;
+    CREATE INDEX checkins_start_time ON checkins(start_time);
+
+    CREATE TRIGGER checkins_closed AFTER UPDATE OF end_time ON checkins
+    WHEN OLD.end_time IS NULL AND NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO world_stats (world_id, visits, seconds)
+        VALUES (NEW.world_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(world_id) DO UPDATE SET visits = visits + 1, seconds = seconds + excluded.seconds;
+
+        INSERT INTO daily_stats (day, checkins, seconds)
+        VALUES (date(NEW.start_time + NEW.start_offset * 60, 'unixepoch'), 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(day) DO UPDATE SET checkins = checkins + 1, seconds = seconds + excluded.seconds;
+    END;
+
+    CREATE TRIGGER checkins_inserted_closed AFTER INSERT ON checkins
+    WHEN NEW.end_time IS NOT NULL
+    BEGIN
+        INSERT INTO world_stats (world_id, visits, seconds)
+        VALUES (NEW.world_id, 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(world_id) DO UPDATE SET visits = visits + 1, seconds = seconds + excluded.seconds;
+
+        INSERT INTO daily_stats (day, checkins, seconds)
+        VALUES (date(NEW.start_time + NEW.start_offset * 60, 'unixepoch'), 1, max(NEW.end_time - NEW.start_time, 0))
+        ON CONFLICT(day) DO UPDATE SET checkins = checkins + 1, seconds = seconds + excluded.seconds;
+    END;
+    """,
+    # Resuming a log reads who's still there from the database, so
+    # checkpoints don't need their own copy
+    """
+    ALTER TABLE checkpoints DROP COLUMN visitors;
+    """,
+    # What maintenance has merged away or deleted, so that reading the same
+    # logs again doesn't bring it back and count it in the statistics twice
+    """
+    CREATE TABLE merged_checkins (
+        world_id TEXT NOT NULL,
+        start_time INTEGER NOT NULL,
+        PRIMARY KEY (world_id, start_time)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE visitor_retention (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        deleted_before INTEGER NOT NULL
+    );
+
+    CREATE TRIGGER checkins_insert_merged BEFORE INSERT ON checkins
+    WHEN EXISTS (SELECT 1 FROM merged_checkins WHERE world_id = NEW.world_id AND start_time = NEW.start_time)
+    BEGIN
+        SELECT RAISE(IGNORE);
+    END;
+
+    -- Visitors still there were open when the rest were deleted, so may yet
+    -- be updated
+    CREATE TRIGGER visitors_insert_deleted BEFORE INSERT ON visitors
+    WHEN NEW.start_time < (SELECT deleted_before FROM visitor_retention)
+    AND NOT EXISTS (SELECT 1 FROM visitors WHERE world_id = NEW.world_id AND player_id = NEW.player_id AND start_time = NEW.start_time)
+    BEGIN
+        SELECT RAISE(IGNORE);
+    END;
+    """,
+    # Check-ins changed after they closed, such as by merging, in the order
+    # it happened, so incremental exports can write them again
+    """
+    CREATE TABLE checkin_updates (
+        id INTEGER PRIMARY KEY,
+        checkin_id INTEGER NOT NULL
+    );
+
+    CREATE TRIGGER checkins_updated AFTER UPDATE OF end_time ON checkins
+    WHEN OLD.end_time IS NOT NULL AND NEW.end_time IS NOT OLD.end_time
+    BEGIN
+        INSERT INTO checkin_updates (checkin_id) VALUES (NEW.id);
+    END;
+
+    ALTER TABLE exports ADD COLUMN last_update INTEGER NOT NULL DEFAULT 0;
+    """,
+]
+
+
+def migrate_database(db_conn, logger=None):
+    logger = logger or logging.root
+    version = db_conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version >= len(MIGRATIONS):
+        return
+
+    for (number, migration) in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("migrating database to version %d...", number)
+
+        # Each migration and its version bump are committed together, so a
+        # failure part way through leaves the database as it was
+        try:
+            if callable(migration):
+                db_conn.execute("BEGIN")
+                migration(db_conn)
+                db_conn.execute("PRAGMA user_version = {:d}".format(number))
+                db_conn.commit()
+            else:
+                db_conn.executescript(
+                    "BEGIN;\n{}\nPRAGMA user_version = {:d};\nCOMMIT;".format(
+                        migration, number
+                    )
+                )
+        except BaseException:
+            db_conn.rollback()
+            raise
+
+    db_conn.execute("ANALYZE")
+    db_conn.commit()
+    logger.info("database ready")
+
+
+# Logs are read in large blocks and split into lines here, rather than a
+# readline() call for every line
+LOG_CHUNK_SIZE = 64 * 1024
+
+# While a log is quiet we wait for watchdog to tell us it's changed; in case
+# it never does, we also back off to checking every couple of seconds
+TAIL_MIN_DELAY = 0.1
+TAIL_MAX_DELAY = 2.0
+
+# How often to make sure VRChat is still running while its log is quiet
+PROCESS_CHECK_INTERVAL = 5.0
+
+# VRChat creates its log as soon as it starts, so a log created much later
+# than the newest VRChat process we know of means there's one we don't
+PROCESS_START_WINDOW = 60.0
+
+# Logs are followed on a pool of this many threads; more than this many
+# running VRChat clients at once would have to take turns
+FOLLOWER_LIMIT = 8
+
+# All writes go through one thread, which commits whatever has queued up
+# once it's collected this many operations or waited this long
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_DELAY = 0.5
+WRITE_QUEUE_SIZE = 10000
+
+# Read-only connections kept open between exports, stats and searches.
+# More readers than this can still run at once, but they're closed after
+READER_POOL_SIZE = 4
+
+# Maintenance runs once this often, when VRChat has been closed for a while
+MAINTENANCE_INTERVAL = 24 * 60 * 60
+MAINTENANCE_IDLE_DELAY = 10 * 60
+MAINTENANCE_CHUNK_SIZE = 10000
+MAINTENANCE_CHECK_INTERVAL = 60.0
+
+# Check-ins in the same world this close together are really one visit
+MERGE_GAP = 60
+
+# How often the tray tooltip shows an export's progress
+EXPORT_PROGRESS_INTERVAL = 0.5
+
+# Exports stream rows out of the database this many at a time, and write
+# once this much output has built up
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+# Finished logs are archived in blocks of about this much text, each one
+# compressed separately, so that part of a log can be read back on its own
+ARCHIVE_BLOCK_SIZE = 1024 * 1024
+ARCHIVE_FORMATS = {
+    ".gz": (partial(gzip.compress, compresslevel=6), gzip.decompress),
+    ".xz": (lzma.compress, lzma.decompress),
+}
+ARCHIVE_COMPRESSION = ".gz"
+ARCHIVE_TIMESTAMP_PATTERN = re.compile(
+    rb"^(\d{4}\.\d\d\.\d\d \d\d:\d\d:\d\d)", re.MULTILINE
+)
+
+# Upper bounds, in seconds, of the buckets timings are counted into
+METRICS_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+# Regexes inspired by https://github.com/sunasaji/VRC_log_checker
+# Every event we care about contains one of these, so anything else can be
+# thrown away before it ever reaches the regex engine
+LOG_LINE_KEYWORDS = ("Joining", "OnPlayer")
+
+# A single pass over the line tells us which event it is; the name of the
+# group which matched is the event kind
+LOG_LINE_PATTERN = re.compile(
+    r"(?P<timestamp>\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2}).+?"
+    r"(?:Joining or Creating Room: (?P<world_name>.+)"
+    r"|Joining (?P<world_join>wrld_[0-9a-f-]{36})"
+    r"|OnPlayerJoined (?P<player_join>.+)"
+    r"|OnPlayerLeft (?P<player_leave>.+))"
+)
+
+
+def classify_line(line):
+    for keyword in LOG_LINE_KEYWORDS:
+        if keyword in line:
+            break
+    else:
+        return None
+
+    match = LOG_LINE_PATTERN.match(line)
+    if match is None:
+        return None
+
+    kind = match.lastgroup
+    return (kind, match.group("timestamp"), match.group(kind))
+
+
+@lru_cache(maxsize=None)
+def local_tz():
+    from dateutil.tz import gettz
+
+    return gettz()
+
+
+@lru_cache(maxsize=256)
+def parse_log_timestamp(timestamp):
+    # VRChat always writes "YYYY.MM.DD HH:MM:SS", so there's no need to have
+    # dateutil work out the format every time
+    return datetime(
+        int(timestamp[0:4]),
+        int(timestamp[5:7]),
+        int(timestamp[8:10]),
+        int(timestamp[11:13]),
+        int(timestamp[14:16]),
+        int(timestamp[17:19]),
+        tzinfo=local_tz(),
+    )
+
+
+def to_timestamp(date):
+    # Times are stored as seconds since the epoch, along with the UTC offset
+    # in minutes, so they can still be shown as they were written
+    return (int(date.timestamp()), int(date.utcoffset().total_seconds()) // 60)
+
+
+def from_timestamp(seconds, offset):
+    if seconds is None:
+        return None
+
+    return datetime.fromtimestamp(seconds, timezone(timedelta(minutes=offset)))
+
+
+def time_range(since, until):
+    # Open ends become the widest values SQLite can compare against, so the
+    # query can always use the index on start_time
+    return {
+        "since": -(2**63) if since is None else int(since.timestamp()),
+        "until": 2**63 - 1 if until is None else int(until.timestamp()),
+    }
+
+
+def format_duration(seconds):
+    (hours, seconds) = divmod(seconds, 3600)
+    return "{}h {:02d}m".format(hours, seconds // 60)
+
+
+class VRChatProcesses:
+    def __init__(self):
+        # Looked up from the followers, watchdog and the tray all at once
+        self.lock = Lock()
+        self.known = {}
+
+    def scan(self):
+        import psutil
+
+        return {
+            process.pid: process
+            for process in psutil.process_iter(["name"])
+            if process.info["name"] == "VRChat.exe"
+        }
+
+    def find(self, created=None):
+        # Finds the VRChat process which most likely wrote a log created at
+        # `created`, only walking every process on the machine when none of
+        # the ones we already know about could have
+        with self.lock:
+            self.known = {
+                pid: process
+                for (pid, process) in self.known.items()
+                if process.is_running()
+            }
+
+            process = self.owner(created)
+            if process is None or (
+                created is not None
+                and created - process.create_time() > PROCESS_START_WINDOW
+            ):
+                self.known = self.scan()
+                process = self.owner(created)
+
+            return process
+
+    def owner(self, created):
+        return max(
+            (
+                process
+                for process in self.known.values()
+                if created is None
+                or process.create_time() <= created + PROCESS_START_WINDOW
+            ),
+            key=lambda process: process.create_time(),
+            default=None,
+        )
+
+
+def log_created_time(path):
+    # st_ctime is when the file was created on Windows, which is what VRChat
+    # runs on; elsewhere it's the last change, which is close enough
+    return os.stat(path).st_ctime
+
+
+def parse_date_argument(value):
+    from dateutil.parser import parse as parse_date
+    from dateutil.utils import default_tzinfo
+
+    return default_tzinfo(parse_date(value), local_tz())
+
+
+def find_log_files(vrchat_data_dir):
+    return sorted(
+        glob.glob(os.path.join(vrchat_data_dir, "output_log*.txt")),
+        key=os.path.getmtime,
+    )
+
+
+def checkpoint_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def file_identity(stat):
+    return "{}:{}".format(stat.st_dev, stat.st_ino)
+
+
+# What happened in a log, in the order it happened. Times are stored as
+# they are in the database, as epoch seconds and a UTC offset in minutes
+class WorldJoin(namedtuple("WorldJoin", ["time", "offset", "world_id"])):
+    __slots__ = ()
+    kind = "world_join"
+
+
+class WorldName(namedtuple("WorldName", ["time", "offset", "name"])):
+    __slots__ = ()
+    kind = "world_name"
+
+
+class PlayerJoin(namedtuple("PlayerJoin", ["time", "offset", "name"])):
+    __slots__ = ()
+    kind = "player_join"
+
+
+class PlayerLeave(namedtuple("PlayerLeave", ["time", "offset", "name"])):
+    __slots__ = ()
+    kind = "player_leave"
+
+
+EVENT_TYPES = {
+    event_type.kind: event_type
+    for event_type in (WorldJoin, WorldName, PlayerJoin, PlayerLeave)
+}
+
+
+def iter_events(lines):
+    for line in lines:
+        match = classify_line(line)
+        if match is None:
+            continue
+
+        (kind, timestamp, value) = match
+        yield EVENT_TYPES[kind](*to_timestamp(parse_log_timestamp(timestamp)), value)
+
+
+class EventDispatcher:
+    # Hands each event to every sink in turn, so one pass over a log serves
+    # them all. Sinks run on the reading thread; one which can't keep up
+    # (like the database, once the writer's queue is full) slows the reading
+    # down rather than letting events pile up in memory
+    def __init__(self, sinks, logger=None):
+        self.sinks = list(sinks)
+        self.logger = logger or logging.root
+
+    def call(self, method, *args):
+        for sink in list(self.sinks):
+            try:
+                getattr(sink, method)(*args)
+            except Exception:
+                # One broken sink shouldn't stop the others, such as a feed
+                # file on a full disk stopping history being recorded
+                self.logger.exception("Removing event sink %r", sink)
+                self.sinks.remove(sink)
+
+    def dispatch(self, event):
+        self.call("handle", event)
+
+    def flush(self):
+        self.call("flush")
+
+    def close(self, end):
+        # end is when anything still open ended, or None if it hasn't
+        self.call("close", end)
+
+
+class RowsSink:
+    # Collects rows rather than writing them, so parsing can happen in a
+    # worker process and be stored in one go
+    def __init__(self):
+        self.worlds = {}
+        self.checkins = []
+        self.visitors = []
+
+        self.world_id = None
+        self.checkin = None
+        self.open_visitors = {}
+
+    def handle(self, event):
+        if event.kind == "world_join":
+            self.close((event.time, event.offset))
+
+            self.world_id = event.world_id
+            self.worlds.setdefault(self.world_id, None)
+            self.checkin = [self.world_id, event.time, event.offset, None, None]
+            self.checkins.append(self.checkin)
+
+        elif event.kind == "world_name":
+            if self.world_id is not None:
+                self.worlds[self.world_id] = event.name
+
+        elif event.kind == "player_join":
+            if self.world_id is None or event.name in self.open_visitors:
+                return
+
+            visitor = [self.world_id, event.name, event.time, event.offset, None, None]
+            self.open_visitors[event.name] = visitor
+            self.visitors.append(visitor)
+
+        elif event.kind == "player_leave":
+            visitor = self.open_visitors.pop(event.name, None)
+            if visitor is not None:
+                visitor[4:6] = (event.time, event.offset)
+
+    def flush(self):
+        pass
+
+    def close(self, end):
+        # Anything still open ended at end, unless that isn't known (when
+        # only part of a log has been read)
+        if end is None:
+            return
+
+        if self.checkin is not None and self.checkin[3] is None:
+            self.checkin[3:5] = end
+        for visitor in self.open_visitors.values():
+            visitor[4:6] = end
+        self.open_visitors = {}
+
+    def rows(self):
+        return (list(self.worlds.items()), self.checkins, self.visitors)
+
+
+class FeedSink:
+    # Appends events to a file as newline-delimited JSON, for anything else
+    # which wants to follow along live
+    def __init__(self, path, log_path=None):
+        self.log_name = os.path.basename(log_path) if log_path else None
+        self.pending = []
+        # Unbuffered, so each flush is a single append and followers sharing
+        # the file never interleave part way through a line
+        self.output_file = open(path, mode="ab", buffering=0)
+
+    def handle(self, event):
+        record = {"event": event.kind, "log": self.log_name, **event._asdict()}
+        self.pending.append(json.dumps(record) + "\n")
+
+    def flush(self):
+        if self.pending:
+            self.output_file.write("".join(self.pending).encode("utf-8"))
+            self.pending = []
+
+    def close(self, end):
+        self.flush()
+        self.output_file.close()
+
+
+class MemorySink:
+    def __init__(self):
+        self.events = []
+        self.end = None
+
+    def handle(self, event):
+        self.events.append(event)
+
+    def flush(self):
+        pass
+
+    def close(self, end):
+        self.end = end
+
+
+def parse_log_file(path):
+    with open(path, mode="r", encoding="utf-8", errors="ignore") as input_file:
+        # The log was last written as VRChat exited, so that's when anything
+        # still open must have ended
+        return parse_log_lines(
+            input_file,
+            to_timestamp(datetime.fromtimestamp(os.path.getmtime(path), local_tz())),
+        )
+
+
+def parse_log_lines(lines, end):
+    # Replays a finished log using the same rules as follow_log_file, but
+    # collects rows rather than writing them, so it can run in a worker process
+    sink = RowsSink()
+    dispatcher = EventDispatcher([sink])
+    for event in iter_events(lines):
+        dispatcher.dispatch(event)
+    dispatcher.close(end)
+
+    return sink.rows()
+
+
+def archive_log_file(path, archive_path, block_size=ARCHIVE_BLOCK_SIZE):
+    (compress, _) = ARCHIVE_FORMATS[os.path.splitext(archive_path)[1]]
+    blocks = []
+    offset = 0
+    raw_offset = 0
+    last_time = None
+
+    # Written alongside, so a half-written archive never replaces a good one
+    with open(path, mode="rb") as input_file:
+        with open(archive_path + ".tmp", mode="wb") as output_file:
+            while True:
+                # Blocks end on a line break, so each one can be parsed alone
+                block = input_file.read(block_size)
+                if not block:
+                    break
+                block += input_file.readline()
+
+                timestamps = ARCHIVE_TIMESTAMP_PATTERN.findall(block)
+                (start_time, end_time) = (
+                    (
+                        to_timestamp(parse_log_timestamp(timestamps[0].decode()))[0],
+                        to_timestamp(parse_log_timestamp(timestamps[-1].decode()))[0],
+                    )
+                    if timestamps
+                    else (last_time, last_time)
+                )
+                last_time = end_time
+
+                data = compress(block)
+                output_file.write(data)
+                blocks.append(
+                    (offset, len(data), raw_offset, len(block), start_time, end_time)
+                )
+                offset += len(data)
+                raw_offset += len(block)
+
+    os.replace(archive_path + ".tmp", archive_path)
+
+    return (
+        os.path.basename(path),
+        os.path.basename(archive_path),
+        raw_offset,
+        int(os.path.getmtime(path)),
+        blocks,
+    )
+
+
+def read_archive_lines(archive_path, blocks):
+    (_, decompress) = ARCHIVE_FORMATS[os.path.splitext(archive_path)[1]]
+
+    with open(archive_path, mode="rb") as archive_file:
+        for (offset, length) in blocks:
+            archive_file.seek(offset)
+            yield from decompress(archive_file.read(length)).decode(
+                "utf-8", errors="ignore"
+            ).splitlines()
+
+
+def parse_archive(archive_path, blocks, mtime=None):
+    # Only when the last block is included do we know when the log ended
+    return parse_log_lines(
+        read_archive_lines(archive_path, blocks),
+        None
+        if mtime is None
+        else to_timestamp(datetime.fromtimestamp(mtime, local_tz())),
+    )
+
+
+def format_metric_name(name, labels):
+    if not labels:
+        return name
+
+    return "{}{{{}}}".format(
+        name, ",".join('{}="{}"'.format(key, value) for (key, value) in labels)
+    )
+
+
+class Metrics:
+    def __init__(self, profile_dir=None, logger=None):
+        self.profile_dir = profile_dir
+        self.logger = logger or logging.root
+        self.started = time.monotonic()
+
+        # Updated from the followers, the writer and exports all at once
+        self.lock = Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+        # cProfile only sees the thread it's enabled on, so each instrumented
+        # thread starts and stops its own profile when this changes
+        self.profiling = False
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * (len(METRICS_BUCKETS) + 1),
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                }
+
+            histogram["buckets"][bisect_left(METRICS_BUCKETS, seconds)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "uptime": time.monotonic() - self.started,
+                "counters": {
+                    format_metric_name(*key): value
+                    for (key, value) in sorted(self.counters.items())
+                },
+                "gauges": {
+                    format_metric_name(*key): value
+                    for (key, value) in sorted(self.gauges.items())
+                },
+                "histograms": {
+                    format_metric_name(*key): dict(
+                        value, buckets=list(value["buckets"])
+                    )
+                    for (key, value) in sorted(self.histograms.items())
+                },
+                "profiling": self.profiling,
+            }
+
+    def format_prometheus(self):
+        lines = []
+        typed = set()
+
+        with self.lock:
+            for (kind, metrics) in (("counter", self.counters), ("gauge", self.gauges)):
+                for ((name, labels), value) in sorted(metrics.items()):
+                    if name not in typed:
+                        lines.append("# TYPE warptrail_{} {}".format(name, kind))
+                        typed.add(name)
+
+                    lines.append(
+                        "{} {}".format(
+                            format_metric_name("warptrail_" + name, labels), value
+                        )
+                    )
+
+            bounds = [str(bound) for bound in METRICS_BUCKETS] + ["+Inf"]
+            for ((name, labels), histogram) in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append("# TYPE warptrail_{} histogram".format(name))
+                    typed.add(name)
+
+                total = 0
+                for (bound, count) in zip(bounds, histogram["buckets"]):
+                    total += count
+                    lines.append(
+                        "{} {}".format(
+                            format_metric_name(
+                                "warptrail_{}_bucket".format(name),
+                                labels + (("le", bound),),
+                            ),
+                            total,
+                        )
+                    )
+
+                for field in ("sum", "count"):
+                    lines.append(
+                        "{} {}".format(
+                            format_metric_name(
+                                "warptrail_{}_{}".format(name, field), labels
+                            ),
+                            histogram[field],
+                        )
+                    )
+
+        return "".join(line + "\n" for line in lines)
+
+    def format_summary(self):
+        snapshot = self.snapshot()
+        lines = ["Running for {}".format(format_duration(int(snapshot["uptime"])))]
+
+        for (name, value) in snapshot["counters"].items():
+            lines.append("{}: {:,}".format(name, value))
+        for (name, value) in snapshot["gauges"].items():
+            lines.append("{}: {:,}".format(name, value))
+        for (name, histogram) in snapshot["histograms"].items():
+            lines.append(
+                "{}: {:,} times, mean {:.2f} ms, max {:.2f} ms".format(
+                    name,
+                    histogram["count"],
+                    histogram["sum"] / histogram["count"] * 1000,
+                    histogram["max"] * 1000,
+                )
+            )
+
+        lines.append("Profiling: {}".format("on" if snapshot["profiling"] else "off"))
+        return "\n".join(lines)
+
+    def update_profile(self, profile):
+        # Called regularly by each instrumented thread, with the profile it
+        # has running (if any); returns the one it should have running now
+        if self.profiling and profile is None:
+            profile = cProfile.Profile()
+            profile.enable()
+        elif not self.profiling and profile is not None:
+            self.finish_profile(profile)
+            profile = None
+
+        return profile
+
+    def finish_profile(self, profile):
+        if profile is None:
+            return
+
+        profile.disable()
+        path = os.path.join(
+            self.profile_dir or ".",
+            "WarpTrail-{}-{}.prof".format(current_thread().name, int(time.time())),
+        )
+        profile.dump_stats(path)
+        self.logger.info("Saved profile to %s", path)
+
+
+def serve_metrics(metrics, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.format_prometheus()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.snapshot())
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    # Only ever on localhost; there's nothing here anyone else should see
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+class DatabaseWriter:
+    def __init__(self, database_path, logger=None, metrics=None):
+        self.database_path = database_path
+        self.logger = logger or logging.root
+        self.metrics = metrics or Metrics(logger=self.logger)
+
+        # Bounded, so that a writer which can't keep up slows the followers
+        # down rather than eating memory
+        self.queue = Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.thread = Thread(target=self.run, name="DatabaseWriter", daemon=True)
+
+        # Players mostly turn up again and again, so remember their IDs
+        self.player_ids = {}
+
+        # Called on the writer thread after each commit, with the number of
+        # operations in the batch and how long the commit took
+        self.on_commit = None
+
+    def start(self):
+        # Connect up front so that problems opening the database show up
+        # here; from now on only the writer thread uses the connection
+        self.db_conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        # Safe with WAL; a crash can lose the last commit, but never corrupt
+        self.db_conn.execute("PRAGMA synchronous = NORMAL")
+        self.thread.start()
+
+    def submit(self, operation):
+        # Only slow when the queue is full, and the writer is behind
+        start = time.perf_counter()
+        self.queue.put(operation)
+        self.metrics.observe(
+            "stage_seconds", time.perf_counter() - start, stage="queue"
+        )
+
+    def execute(self, sql, parameters=()):
+        self.submit(lambda db: db.execute(sql, parameters))
+
+    def player_id(self, db, name):
+        # Only ever called on the writer thread, which is the only thing
+        # adding players; rolling back forgets the cache, as it may hold
+        # players which were never committed
+        player_id = self.player_ids.get(name)
+
+        if player_id is None:
+            db.execute("INSERT OR IGNORE INTO players (name) VALUES (?)", (name,))
+            (player_id,) = db.execute(
+                "SELECT id FROM players WHERE name = ?", (name,)
+            ).fetchone()
+            self.player_ids[name] = player_id
+
+        return player_id
+
+    def flush(self):
+        # Wait until everything submitted so far has been committed
+        committed = ThreadingEvent()
+        self.queue.put(committed)
+        committed.wait()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def apply(self, db_conn, db, operation):
+        # Each operation gets a savepoint inside the batch's transaction, so
+        # one which fails is undone without losing the rest of the batch, and
+        # without taking the writer thread down with it
+        if not db_conn.in_transaction:
+            db.execute("BEGIN")
+        db.execute("SAVEPOINT operation")
+
+        try:
+            operation(db)
+        except Exception:
+            self.logger.exception("Database write failed")
+            self.player_ids = {}
+            try:
+                db.execute("ROLLBACK TO operation")
+            except sqlite3.Error:
+                # The operation committed by itself, so there's nothing left
+                # to undo
+                pass
+
+        try:
+            db.execute("RELEASE operation")
+        except sqlite3.Error:
+            pass
+
+    def run(self):
+        db_conn = self.db_conn
+        db = db_conn.cursor()
+        profile = None
+
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            profile = self.metrics.update_profile(profile)
+            deadline = time.monotonic() + WRITE_BATCH_DELAY
+
+            while (
+                len(batch) < WRITE_BATCH_SIZE
+                and batch[-1] is not None
+                and not isinstance(batch[-1], ThreadingEvent)
+            ):
+                try:
+                    batch.append(
+                        self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    )
+                except Empty:
+                    break
+
+            committed = []
+            written = 0
+            for operation in batch:
+                if operation is None:
+                    running = False
+                elif isinstance(operation, ThreadingEvent):
+                    committed.append(operation)
+                else:
+                    written += 1
+                    self.apply(db_conn, db, operation)
+
+            try:
+                commit_start = time.perf_counter()
+                db_conn.commit()
+                commit_seconds = time.perf_counter() - commit_start
+                self.metrics.observe("stage_seconds", commit_seconds, stage="commit")
+                self.metrics.count("writes_total", written)
+                self.metrics.set("write_queue_depth", self.queue.qsize())
+                if self.on_commit is not None:
+                    self.on_commit(written, commit_seconds)
+            except Exception:
+                self.logger.exception("Database commit failed")
+                self.player_ids = {}
+                db_conn.rollback()
+            finally:
+                # Whatever happened, nobody should be left waiting
+                for event in committed:
+                    event.set()
+
+        self.metrics.finish_profile(profile)
+        db_conn.close()
+
+
+class ReaderPool:
+    def __init__(self, database_path, size=READER_POOL_SIZE, metrics=None):
+        self.database_path = database_path
+        self.metrics = metrics or Metrics()
+
+        # Most recently used first, so its page cache is still warm
+        self.idle = LifoQueue(maxsize=size)
+        self.closed = False
+
+    def open(self):
+        db_conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        # Anything that tries to write here is a bug; writes belong on the
+        # writer thread
+        db_conn.execute("PRAGMA query_only = ON")
+        self.metrics.count("reader_connects_total")
+        return db_conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            db_conn = self.idle.get_nowait()
+        except Empty:
+            db_conn = self.open()
+
+        try:
+            yield db_conn
+        finally:
+            # Let go of any snapshot, or the WAL can't be checkpointed past it
+            db_conn.rollback()
+            if self.closed:
+                db_conn.close()
+            else:
+                try:
+                    self.idle.put_nowait(db_conn)
+                except Full:
+                    db_conn.close()
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+
+class Session:
+    # The check-in and visitors a log currently has open, by row ID, so they
+    # can be closed without searching for them. Only ever used on the writer
+    # thread, which runs these methods in the order the log was read
+    __slots__ = ("player_id", "world_id", "checkin_id", "visitor_ids")
+
+    def __init__(self, player_id):
+        self.player_id = player_id
+        self.world_id = None
+        self.checkin_id = None
+        self.visitor_ids = {}
+
+    def resume(self, db, world_id):
+        # Picking up a log part way through, so find what was left open
+        self.world_id = world_id
+        row = db.execute(
+            "SELECT id FROM checkins WHERE world_id = ? AND end_time IS NULL ORDER BY start_time DESC LIMIT 1",
+            (world_id,),
+        ).fetchone()
+        self.checkin_id = row[0] if row else None
+        self.visitor_ids = {
+            name: visitor_id
+            for (visitor_id, name) in db.execute(
+                "SELECT visitors.id, players.name FROM visitors INNER JOIN players ON visitors.player_id = players.id WHERE visitors.world_id = ? AND visitors.end_time IS NULL",
+                (world_id,),
+            )
+        }
+
+    def enter(self, db, world_id, start_time, start_offset):
+        self.close(db, start_time, start_offset)
+
+        self.world_id = world_id
+        db.execute("INSERT OR IGNORE INTO worlds (id) VALUES (?)", (world_id,))
+        db.execute(
+            "INSERT OR IGNORE INTO checkins (world_id, start_time, start_offset) VALUES (?, ?, ?)",
+            (world_id, start_time, start_offset),
+        )
+        if db.rowcount == 1:
+            self.checkin_id = db.lastrowid
+        else:
+            # Already stored by an earlier run over the same log, or merged
+            # away by maintenance since
+            row = db.execute(
+                "SELECT id FROM checkins WHERE world_id = ? AND start_time = ?",
+                (world_id, start_time),
+            ).fetchone()
+            self.checkin_id = row[0] if row else None
+
+    def join(self, db, name, start_time, start_offset):
+        if self.world_id is None or name in self.visitor_ids:
+            return
+
+        player_id = self.player_id(db, name)
+        db.execute(
+            "INSERT OR IGNORE INTO visitors (world_id, player_id, start_time, start_offset) VALUES (?, ?, ?, ?)",
+            (self.world_id, player_id, start_time, start_offset),
+        )
+        if db.rowcount == 1:
+            self.visitor_ids[name] = db.lastrowid
+        else:
+            row = db.execute(
+                "SELECT id FROM visitors WHERE world_id = ? AND player_id = ? AND start_time = ?",
+                (self.world_id, player_id, start_time),
+            ).fetchone()
+            if row is not None:
+                self.visitor_ids[name] = row[0]
+
+    def leave(self, db, name, end_time, end_offset):
+        visitor_id = self.visitor_ids.pop(name, None)
+        if visitor_id is not None:
+            db.execute(
+                "UPDATE visitors SET end_time = ?, end_offset = ? WHERE id = ? AND end_time IS NULL",
+                (end_time, end_offset, visitor_id),
+            )
+
+    def close(self, db, end_time, end_offset):
+        if self.checkin_id is not None:
+            db.execute(
+                "UPDATE checkins SET end_time = ?, end_offset = ? WHERE id = ? AND end_time IS NULL",
+                (end_time, end_offset, self.checkin_id),
+            )
+        db.executemany(
+            "UPDATE visitors SET end_time = ?, end_offset = ? WHERE id = ? AND end_time IS NULL",
+            (
+                (end_time, end_offset, visitor_id)
+                for visitor_id in self.visitor_ids.values()
+            ),
+        )
+
+        self.checkin_id = None
+        self.visitor_ids = {}
+
+
+class DatabaseSink:
+    # Records a followed log in the database as it happens, through the
+    # writer. Also keeps track of the current world, for the log's checkpoint
+    def __init__(self, writer, world_id=None, logger=None):
+        self.writer = writer
+        self.logger = logger or logging.root
+        self.session = Session(writer.player_id)
+        self.world_id = world_id
+
+        if world_id is not None:
+            self.writer.submit(partial(self.session.resume, world_id=world_id))
+
+    def handle(self, event):
+        session = self.session
+
+        if event.kind == "world_join":
+            self.world_id = event.world_id
+            self.logger.info(
+                "Entered world %s at %s",
+                event.world_id,
+                from_timestamp(event.time, event.offset).isoformat(),
+            )
+
+            # Ends the previous world's check-in and visitors, and starts a
+            # fresh check-in
+            self.writer.submit(
+                partial(
+                    session.enter,
+                    world_id=event.world_id,
+                    start_time=event.time,
+                    start_offset=event.offset,
+                )
+            )
+
+        elif event.kind == "world_name":
+            self.logger.info('Found world name: "%s"', event.name)
+            self.writer.execute(
+                "UPDATE worlds SET name = :name WHERE id = :id",
+                {"name": event.name, "id": self.world_id},
+            )
+
+        elif event.kind == "player_join":
+            self.logger.info('Player "%s" Joined', event.name)
+            self.writer.submit(
+                partial(
+                    session.join,
+                    name=event.name,
+                    start_time=event.time,
+                    start_offset=event.offset,
+                )
+            )
+
+        elif event.kind == "player_leave":
+            self.logger.info('Player "%s" Left', event.name)
+            self.writer.submit(
+                partial(
+                    session.leave,
+                    name=event.name,
+                    end_time=event.time,
+                    end_offset=event.offset,
+                )
+            )
+
+    def flush(self):
+        pass
+
+    def close(self, end):
+        if end is None:
+            # WarpTrail is exiting while VRChat is still running, so leave
+            # everything open for the next time we follow this log
+            return
+
+        self.writer.submit(
+            partial(self.session.close, end_time=end[0], end_offset=end[1])
+        )
+
+
+def store_archive(db, archive):
+    (name, file, size, mtime, blocks) = archive
+    db.execute(
+        "INSERT INTO archives (name, file, size, mtime) VALUES (?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET file = excluded.file, size = excluded.size, mtime = excluded.mtime",
+        (name, file, size, mtime),
+    )
+    (archive_id,) = db.execute(
+        "SELECT id FROM archives WHERE name = ?", (name,)
+    ).fetchone()
+    db.execute("DELETE FROM archive_blocks WHERE archive_id = ?", (archive_id,))
+    db.executemany(
+        "INSERT INTO archive_blocks (archive_id, offset, length, raw_offset, raw_length, start_time, end_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((archive_id, *block) for block in blocks),
+    )
+
+
+def store_parsed_log(db, worlds, checkins, visitors, player_id):
+    # The unique indexes make storing the same log twice a no-op, other than
+    # filling in anything which wasn't known the first time
+    db.executemany(
+        "INSERT INTO worlds (id, name) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET name = coalesce(excluded.name, worlds.name)",
+        worlds,
+    )
+    db.executemany(
+        "INSERT INTO checkins (world_id, start_time, start_offset, end_time, end_offset) VALUES (?, ?, ?, ?, ?) ON CONFLICT(world_id, start_time) DO UPDATE SET end_time = coalesce(checkins.end_time, excluded.end_time), end_offset = coalesce(checkins.end_offset, excluded.end_offset)",
+        checkins,
+    )
+    db.executemany(
+        "INSERT INTO visitors (world_id, player_id, start_time, start_offset, end_time, end_offset) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(world_id, player_id, start_time) DO UPDATE SET end_time = coalesce(visitors.end_time, excluded.end_time), end_offset = coalesce(visitors.end_offset, excluded.end_offset)",
+        [
+            (world_id, player_id(db, name), *times)
+            for (world_id, name, *times) in visitors
+        ],
+    )
+
+
+def close_orphaned_sessions(db):
+    # Check-ins and visitors left open by a log nothing will follow again,
+    # such as when WarpTrail was killed. Logs which will be resumed are left
+    # for their follower to close
+    resumable = json.dumps(
+        [
+            world_id
+            for (path, world_id) in db.execute(
+                "SELECT path, world_id FROM checkpoints WHERE finished = 0 AND world_id IS NOT NULL"
+            )
+            if os.path.exists(path)
+        ]
+    )
+
+    orphans = db.execute(
+        "SELECT id, world_id, start_time, start_offset FROM checkins WHERE end_time IS NULL AND world_id NOT IN (SELECT value FROM json_each(?))",
+        (resumable,),
+    ).fetchall()
+    for (checkin_id, world_id, start_time, start_offset) in orphans:
+        # Until the next check-in, or failing that, the last sign of anyone
+        # else being there
+        end = db.execute(
+            "SELECT start_time, start_offset FROM checkins WHERE start_time > ? ORDER BY start_time LIMIT 1",
+            (start_time,),
+        ).fetchone()
+        if end is None:
+            (end_time,) = db.execute(
+                "SELECT max(max(start_time, coalesce(end_time, start_time))) FROM visitors WHERE world_id = ? AND start_time >= ?",
+                (world_id, start_time),
+            ).fetchone()
+            end = (end_time or start_time, start_offset)
+
+        db.execute(
+            "UPDATE checkins SET end_time = ?, end_offset = ? WHERE id = ? AND end_time IS NULL",
+            (*end, checkin_id),
+        )
+
+    # Visitors leave when the check-in they were part of ended
+    db.execute(
+        """
+        UPDATE visitors SET (end_time, end_offset) = (
+            SELECT max(checkins.end_time, visitors.start_time), checkins.end_offset
+            FROM checkins
+            WHERE checkins.world_id = visitors.world_id AND checkins.start_time <= visitors.start_time
+            ORDER BY checkins.start_time DESC
+            LIMIT 1
+        )
+        WHERE end_time IS NULL AND world_id NOT IN (SELECT value FROM json_each(?))
+        """,
+        (resumable,),
+    )
+
+    return len(orphans) + db.rowcount
+
+
+def merge_adjacent_checkins(db, gap=MERGE_GAP):
+    # Rejoining the same world, or a log read twice with slightly different
+    # times, leaves one visit split over several check-ins
+    rows = db.execute(
+        """
+        SELECT id, previous_id, start_time, start_offset, end_time, end_offset
+        FROM (
+            SELECT *, lag(id) OVER win AS previous_id, lag(world_id) OVER win AS previous_world_id, lag(end_time) OVER win AS previous_end_time
+            FROM checkins
+            WINDOW win AS (ORDER BY start_time, id)
+        )
+        WHERE world_id = previous_world_id AND end_time IS NOT NULL AND start_time <= previous_end_time + :gap
+        ORDER BY start_time, id
+        """,
+        {"gap": gap},
+    ).fetchall()
+
+    heads = {}
+    for (
+        checkin_id,
+        previous_id,
+        start_time,
+        start_offset,
+        end_time,
+        end_offset,
+    ) in rows:
+        head_id = heads.get(previous_id, previous_id)
+        heads[checkin_id] = head_id
+        (world_id, head_start, head_offset, head_end) = db.execute(
+            "SELECT world_id, start_time, start_offset, end_time FROM checkins WHERE id = ?",
+            (head_id,),
+        ).fetchone()
+        if end_time > head_end:
+            db.execute(
+                "UPDATE checkins SET end_time = ?, end_offset = ? WHERE id = ?",
+                (end_time, end_offset, head_id),
+            )
+
+        # The triggers only ever add to the statistics, so take the merged
+        # check-in back out of them by hand
+        head_seconds = max(max(end_time, head_end) - head_start, 0) - max(
+            head_end - head_start, 0
+        )
+        seconds = max(end_time - start_time, 0)
+        db.execute(
+            "UPDATE world_stats SET visits = visits - 1, seconds = seconds + ? WHERE world_id = ?",
+            (head_seconds - seconds, world_id),
+        )
+        db.execute(
+            "UPDATE daily_stats SET checkins = checkins - 1, seconds = seconds - ? WHERE day = date(? + ? * 60, 'unixepoch')",
+            (seconds, start_time, start_offset),
+        )
+        db.execute(
+            "UPDATE daily_stats SET seconds = seconds + ? WHERE day = date(? + ? * 60, 'unixepoch')",
+            (head_seconds, head_start, head_offset),
+        )
+        db.execute(
+            "INSERT OR IGNORE INTO merged_checkins (world_id, start_time) VALUES (?, ?)",
+            (world_id, start_time),
+        )
+        db.execute("DELETE FROM checkins WHERE id = ?", (checkin_id,))
+
+    return len(rows)
+
+
+def delete_old_visitors(db, before, limit=MAINTENANCE_CHUNK_SIZE):
+    # A chunk at a time, so the writer is never tied up for long. Player
+    # statistics keep counting them
+    db.execute(
+        "DELETE FROM visitors WHERE id IN (SELECT id FROM visitors WHERE start_time < ? AND end_time IS NOT NULL LIMIT ?)",
+        (before, limit),
+    )
+    deleted = db.rowcount
+    db.execute(
+        "INSERT INTO visitor_retention (id, deleted_before) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET deleted_before = max(deleted_before, excluded.deleted_before)",
+        (before,),
+    )
+    return deleted
+
+
+def vacuum_incrementally(db):
+    db_conn = db.connection
+    db_conn.commit()
+
+    # Either way, every free page is given back. Counting them, rather than
+    # the change in size, means switching auto_vacuum's extra page is ignored
+    (pages,) = db.execute("PRAGMA freelist_count").fetchone()
+
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Only takes effect after a full VACUUM, which has to happen once.
+        # That may renumber worlds, so its search index is rebuilt too
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+        db.execute("INSERT INTO worlds_search (worlds_search) VALUES ('rebuild')")
+        db_conn.commit()
+    else:
+        db.execute("PRAGMA incremental_vacuum").fetchall()
+        db_conn.commit()
+
+    # Otherwise the WAL stays as big as the largest thing ever written to it
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return pages
+
+
+def optimize_database(db):
+    db.execute("PRAGMA optimize").fetchall()
+    return 0
+
+
+# Stored times shown as they were at the time, in SQL so exports don't need
+# to format them one by one in Python
+DISPLAY_DATETIME_SQL = "coalesce(strftime('%d/%m/%Y, %H:%M', {0}_time + {0}_offset * 60, 'unixepoch'), '(unknown)')"
+ISO_DATETIME_SQL = "strftime('%Y-%m-%dT%H:%M:%S', {0}_time + {0}_offset * 60, 'unixepoch') || printf('%s%02d:%02d', CASE WHEN {0}_offset < 0 THEN '-' ELSE '+' END, abs({0}_offset) / 60, abs({0}_offset) % 60)"
+
+CHECKINS_QUERY = """
+SELECT worlds.id, worlds.name, {}, {}
+FROM checkins
+INNER JOIN worlds
+ON checkins.world_id = worlds.id
+""".format(
+    DISPLAY_DATETIME_SQL.format("checkins.start"),
+    DISPLAY_DATETIME_SQL.format("checkins.end"),
+)
+
+CHECKINS_JSON_QUERY = """
+SELECT json_object(
+    'world_name', worlds.name,
+    'world_url', 'https://vrch.at/' || worlds.id,
+    'start_datetime', {},
+    'end_datetime', {}
+)
+FROM checkins
+INNER JOIN worlds
+ON checkins.world_id = worlds.id
+""".format(
+    ISO_DATETIME_SQL.format("checkins.start"),
+    ISO_DATETIME_SQL.format("checkins.end"),
+)
+
+
+# One complete line per row, built entirely by SQLite. Every field is quoted,
+# and empty when it isn't known
+CSV_FIELD_SQL = "coalesce('\"' || replace({}, '\"', '\"\"') || '\"', '')"
+CSV_HEADER = "kind,world_id,world_name,player_name,start_datetime,end_datetime\n"
+
+CHECKINS_CSV_QUERY = """
+SELECT 'checkin,' || {} || ',' || {} || ',,' || {} || ',' || {} || char(10)
+FROM checkins
+INNER JOIN worlds
+ON checkins.world_id = worlds.id
+""".format(
+    CSV_FIELD_SQL.format("worlds.id"),
+    CSV_FIELD_SQL.format("worlds.name"),
+    CSV_FIELD_SQL.format(ISO_DATETIME_SQL.format("checkins.start")),
+    CSV_FIELD_SQL.format(ISO_DATETIME_SQL.format("checkins.end")),
+)
+
+VISITORS_CSV_QUERY = """
+SELECT 'visitor,' || {} || ',' || {} || ',' || {} || ',' || {} || ',' || {} || char(10)
+FROM visitors
+INNER JOIN worlds
+ON visitors.world_id = worlds.id
+INNER JOIN players
+ON visitors.player_id = players.id
+""".format(
+    CSV_FIELD_SQL.format("worlds.id"),
+    CSV_FIELD_SQL.format("worlds.name"),
+    CSV_FIELD_SQL.format("players.name"),
+    CSV_FIELD_SQL.format(ISO_DATETIME_SQL.format("visitors.start")),
+    CSV_FIELD_SQL.format(ISO_DATETIME_SQL.format("visitors.end")),
+)
+
+CHECKINS_NDJSON_QUERY = """
+SELECT json_object(
+    'kind', 'checkin',
+    'world_name', worlds.name,
+    'world_url', 'https://vrch.at/' || worlds.id,
+    'start_datetime', {},
+    'end_datetime', {}
+) || char(10)
+FROM checkins
+INNER JOIN worlds
+ON checkins.world_id = worlds.id
+""".format(
+    ISO_DATETIME_SQL.format("checkins.start"),
+    ISO_DATETIME_SQL.format("checkins.end"),
+)
+
+VISITORS_NDJSON_QUERY = """
+SELECT json_object(
+    'kind', 'visitor',
+    'world_name', worlds.name,
+    'world_url', 'https://vrch.at/' || worlds.id,
+    'player_name', players.name,
+    'start_datetime', {},
+    'end_datetime', {}
+) || char(10)
+FROM visitors
+INNER JOIN worlds
+ON visitors.world_id = worlds.id
+INNER JOIN players
+ON visitors.player_id = players.id
+""".format(
+    ISO_DATETIME_SQL.format("visitors.start"),
+    ISO_DATETIME_SQL.format("visitors.end"),
+)
+
+
+def iter_rows(cursor, progress=None, total=None, done=0):
+    while True:
+        if progress is not None:
+            progress(done, total)
+
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            return
+
+        done += len(rows)
+        yield from rows
+
+
+def format_markdown(rows, continuing=False):
+    if not continuing:
+        yield "# WarpTrail Location History\n\n"
+
+    for (world_id, world_name, start_datetime, end_datetime) in rows:
+        yield """- [{}](https://vrch.at/{})  
+  from {} until {}
+""".format(
+            (world_name or world_id),
+            world_id,
+            start_datetime,
+            end_datetime,
+        )
+
+
+def format_text(rows, continuing=False):
+    for (world_id, world_name, start_datetime, end_datetime) in rows:
+        yield "{} (https://vrch.at/{}), from {} until {}\n".format(
+            (world_name or world_id),
+            world_id,
+            start_datetime,
+            end_datetime,
+        )
+
+
+def format_json(rows, continuing=False):
+    # SQLite builds each object; we only have to join them into an array
+    if not continuing:
+        yield "["
+
+    separator = "," if continuing else ""
+    for (row,) in rows:
+        yield separator
+        yield row
+        separator = ","
+
+    yield "]"
+
+
+def format_lines(rows, continuing=False):
+    for (line,) in rows:
+        yield line
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def reopen_json_array(path):
+    # Takes the closing bracket off an exported array, so more can be added;
+    # returns whether the array already had anything in it
+    with open(path, mode="rb+") as json_file:
+        size = json_file.seek(0, os.SEEK_END)
+        json_file.seek(max(size - 2, 0))
+        tail = json_file.read()
+
+        if not tail.endswith(b"]"):
+            raise ValueError("{} doesn't end with a JSON array".format(path))
+
+        if tail == b"[]":
+            json_file.truncate(size - 2)
+            return False
+
+        json_file.truncate(size - 1)
+        return True
+
+
+def write_buffered(output_file, chunks):
+    buffer = []
+    buffered = 0
+    written = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+
+        if buffered >= EXPORT_BUFFER_SIZE:
+            output_file.write("".join(buffer))
+            written += buffered
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        output_file.write("".join(buffer))
+
+    return written + buffered
+
+
+class SplitFiles:
+    # Written to like a file, but starts a new numbered part whenever the
+    # next line would take the current one over max_bytes. Lines are never
+    # split, so each part can be loaded on its own
+    def __init__(self, path, max_bytes, header=""):
+        (self.root, self.extension) = os.path.splitext(path)
+        self.max_bytes = max_bytes
+        self.header = header.encode("utf-8")
+        self.paths = []
+        self.output_file = None
+        self.size = 0
+
+    def part_pattern(self):
+        return "{}-{}{}".format(
+            glob.escape(self.root), "[0-9]" * 4, glob.escape(self.extension)
+        )
+
+    def start_part(self):
+        if self.output_file is not None:
+            self.output_file.close()
+
+        path = "{}-{:04d}{}".format(self.root, len(self.paths) + 1, self.extension)
+        self.paths.append(path)
+        self.output_file = open(path, mode="wb")
+        self.output_file.write(self.header)
+        self.size = len(self.header)
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        while data:
+            if self.output_file is None:
+                self.start_part()
+
+            room = self.max_bytes - self.size
+            if len(data) <= room:
+                self.output_file.write(data)
+                self.size += len(data)
+                return
+
+            end = data.rfind(b"\n", 0, room) + 1
+            if not end:
+                if self.size > len(self.header):
+                    self.start_part()
+                    continue
+
+                # A line bigger than a whole part gets a part to itself
+                end = data.find(b"\n") + 1 or len(data)
+
+            self.output_file.write(data[:end])
+            self.size += end
+            data = data[end:]
+            if data:
+                self.start_part()
+
+    def close(self):
+        # Even with nothing to export, there's a part with the header in
+        if self.output_file is None:
+            self.start_part()
+        self.output_file.close()
+
+
+ExportFormat = namedtuple(
+    "ExportFormat",
+    ["name", "query", "formatter", "visitors_query", "header", "lines"],
+    defaults=[None, "", False],
+)
+
+# Add to this to export in another format. query and visitors_query select
+# the rows handed to formatter; formats with lines set write one row per
+# line, and can be split into parts
+EXPORT_FORMATS = {
+    ".md": ExportFormat("Markdown", CHECKINS_QUERY, format_markdown),
+    ".txt": ExportFormat("Plain Text", CHECKINS_QUERY, format_text),
+    ".json": ExportFormat("JSON Data", CHECKINS_JSON_QUERY, format_json),
+    ".csv": ExportFormat(
+        "CSV",
+        CHECKINS_CSV_QUERY,
+        format_lines,
+        VISITORS_CSV_QUERY,
+        header=CSV_HEADER,
+        lines=True,
+    ),
+    ".ndjson": ExportFormat(
+        "JSON Lines",
+        CHECKINS_NDJSON_QUERY,
+        format_lines,
+        VISITORS_NDJSON_QUERY,
+        lines=True,
+    ),
+}
+
+
+def export_filetypes():
+    return [
+        (export_format.name, extension)
+        for (extension, export_format) in EXPORT_FORMATS.items()
+    ]
+
+
+class LogFollowers:
+    def __init__(self, follow, max_workers=FOLLOWER_LIMIT, logger=None):
+        self.follow = follow
+        self.max_workers = max_workers
+        self.logger = logger or logging.root
+
+        self.lock = Lock()
+        self.executor = None
+        self.active = {}
+
+    def start(self, path, responsible_process):
+        path = checkpoint_path(path)
+
+        with self.lock:
+            # watchdog, resuming and clients restarting can all ask for the
+            # same log; only one follower may read it
+            if path in self.active:
+                self.logger.info("Already following %s", path)
+                return False
+
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="LogFollower"
+                )
+
+            future = self.executor.submit(self.follow, path, responsible_process)
+            self.active[path] = future
+
+        future.add_done_callback(partial(self.finished, path))
+        return True
+
+    def finished(self, path, future):
+        with self.lock:
+            if self.active.get(path) is future:
+                del self.active[path]
+
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error("Stopped following %s", path, exc_info=future.exception())
+
+    def stop(self, wait=False):
+        # Followers which haven't started yet never will; running ones see
+        # the app's stop event
+        with self.lock:
+            (executor, self.executor) = (self.executor, None)
+
+        # Outside the lock, as cancelling calls finished()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class ExportJob:
+    # Exports on a thread of its own, so the tray menu stays responsive.
+    # on_progress and on_done are called from that thread
+    def __init__(self, app, path, on_progress=None, on_done=None, **options):
+        self.app = app
+        self.path = path
+        self.options = options
+        self.on_progress = on_progress
+        self.on_done = on_done
+
+        self.written = 0
+        self.total = None
+        self.error = None
+        self.cancelled = ThreadingEvent()
+        self.thread = Thread(target=self.run, name="Export", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self, written, total):
+        if self.cancelled.is_set():
+            raise ExportCancelled()
+
+        (self.written, self.total) = (written, total)
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def run(self):
+        try:
+            self.app.export(self.path, progress=self.progress, **self.options)
+            self.app.logger.info("Exported %s", self.path)
+        except ExportCancelled:
+            self.app.logger.info("Cancelled exporting %s", self.path)
+        except Exception as e:
+            self.app.logger.exception("Couldn't export %s", self.path)
+            self.error = e
+
+        if self.on_done is not None:
+            self.on_done(self)
+
+
+class FileCreatedEventHandler:
+    def __init__(self, app, logger=None):
+        self.app = app
+        self.logger = logger or logging.root
+
+    # watchdog's observer only ever calls dispatch(), so there's no need to
+    # import it just to subclass FileSystemEventHandler
+    def dispatch(self, event):
+        if event.event_type == "created":
+            self.on_created(event)
+        elif event.event_type == "modified":
+            self.on_modified(event)
+
+    def on_created(self, event):
+        if event.is_directory:
+            return
+
+        relpath = os.path.relpath(event.src_path, self.app.vrchat_data_dir)
+
+        if not relpath.startswith("output_log"):
+            return
+
+        self.logger.info("VRChat log file detected: %s", relpath)
+
+        vrchat_process = self.app.vrchat_processes.find(
+            log_created_time(event.src_path)
+        )
+
+        if vrchat_process is None:
+            # Read what's there, but don't wait around for more
+            self.logger.info("No VRChat process found for %s", relpath)
+        else:
+            self.logger.info("VRChat process detected: %d", vrchat_process.pid)
+
+        self.app.follow_in_background(event.src_path, vrchat_process)
+
+    def on_modified(self, event):
+        if event.is_directory:
+            return
+
+        self.app.notify_log_modified(event.src_path)
+
+
+VRCHAT_DIR = "%LOCALAPPDATA%\\..\\LocalLow\\VRChat\\VRChat"
+
+
+class WarpTrailApp:
+    @staticmethod
+    def get_user_data_dir():
+        user_data_dir = AppDirs("WarpTrail", "ticky").user_data_dir
+        old_user_data_dir = AppDirs("VRCTracker", "ticky").user_data_dir
+
+        if not os.path.isdir(user_data_dir):
+            # Migrate old data if it exists
+            if os.path.isdir(old_user_data_dir):
+                os.rename(old_user_data_dir, user_data_dir)
+                os.rename(
+                    os.path.join(user_data_dir, "VRCTracker.db"),
+                    os.path.join(user_data_dir, "WarpTrail.db"),
+                )
+
+            else:
+                os.makedirs(user_data_dir, exist_ok=True)
+
+        return user_data_dir
+
+    @staticmethod
+    def get_vrchat_data_dir():
+        expanded_dir = os.path.expandvars(VRCHAT_DIR)
+
+        # Fallback for non-windows systems
+        if expanded_dir == VRCHAT_DIR:
+            return AppDirs("VRChat", "VRChat").user_data_dir
+
+        return os.path.abspath(expanded_dir)
+
+    def __init__(
+        self,
+        user_data_dir=None,
+        vrchat_data_dir=None,
+        database_path=None,
+        logger=None,
+    ):
+        self.logger = logger or logging.root
+        self.log_wakeups = {}
+
+        if user_data_dir is None:
+            user_data_dir = WarpTrailApp.get_user_data_dir()
+        if vrchat_data_dir is None:
+            vrchat_data_dir = WarpTrailApp.get_vrchat_data_dir()
+
+        self.logger.debug("user_data_dir: %s", user_data_dir)
+
+        self.vrchat_data_dir = vrchat_data_dir
+
+        self.logger.debug("vrchat_data_dir: %s", self.vrchat_data_dir)
+
+        if database_path is None:
+            self.database_path = os.path.join(user_data_dir, "WarpTrail.db")
+        else:
+            self.database_path = database_path
+
+        self.logger.debug("database_path: %s", self.database_path)
+        db_conn = sqlite3.connect(self.database_path)
+
+        # Let exports read while the writer is busy, and avoid a full
+        # rollback journal being written and synced for every commit
+        db_conn.execute("PRAGMA journal_mode = WAL")
+
+        migrate_database(db_conn, self.logger)
+        db_conn.close()
+
+        self.archive_dir = os.path.join(user_data_dir, "Archive")
+        self.archive_logs = True
+        self.archive_block_size = ARCHIVE_BLOCK_SIZE
+
+        # At most one export runs in the background at a time
+        self.export_job = None
+        self.export_progress_shown = 0.0
+
+        # Called with each followed log's path, to make more event sinks
+        # which want to see what happens in it
+        self.sink_factories = []
+
+        # Visitors older than this many days are deleted; None keeps them all
+        self.visitor_retention = None
+        self.last_active = time.monotonic()
+
+        self.metrics = Metrics(profile_dir=user_data_dir, logger=self.logger)
+        self.writer = DatabaseWriter(self.database_path, self.logger, self.metrics)
+        self.writer.start()
+        self.readers = ReaderPool(self.database_path, metrics=self.metrics)
+
+        self.vrchat_processes = VRChatProcesses()
+        self.followers = LogFollowers(self.follow_log_file, logger=self.logger)
+
+    def format_as(
+        self,
+        extension,
+        output_file,
+        since=None,
+        until=None,
+        watermark=None,
+        continuing=False,
+        progress=None,
+        visitors=False,
+    ):
+        export_format = EXPORT_FORMATS.get(extension)
+        if export_format is None:
+            raise NotImplementedError("Unexpected file extension: {}".format(extension))
+        if visitors and export_format.visitors_query is None:
+            raise ValueError(
+                "{} exports can't include visitors".format(export_format.name)
+            )
+
+        # Without any bounds, reading the table in order is quickest
+        conditions = []
+        parameters = time_range(since, until)
+        if since is not None:
+            conditions.append("checkins.start_time >= :since")
+        if until is not None:
+            conditions.append("checkins.start_time < :until")
+        if watermark is not None:
+            # Only check-ins newer than the last export, which were open then
+            # and have closed since, or which have changed since
+            conditions.append(
+                "(checkins.id > :last_id OR (checkins.id IN (SELECT value FROM json_each(:open_ids)) AND checkins.end_time IS NOT NULL) OR checkins.id IN (SELECT checkin_id FROM checkin_updates WHERE id > :last_update))"
+            )
+            parameters["last_id"] = watermark[0]
+            parameters["open_ids"] = json.dumps(watermark[1])
+            parameters["last_update"] = watermark[2]
+        where = ""
+        queries = [export_format.query]
+        if conditions:
+            where = "WHERE {}\n".format(" AND ".join(conditions))
+            queries[0] += where + "ORDER BY checkins.id\n"
+        counts = ["SELECT count(*) FROM checkins\n" + where]
+
+        if visitors:
+            where = ""
+            if since is not None or until is not None:
+                where = "WHERE visitors.start_time >= :since AND visitors.start_time < :until\n"
+            queries.append(export_format.visitors_query + where)
+            counts.append("SELECT count(*) FROM visitors\n" + where)
+
+        # TODO: Gracefully handle errors fetching from database
+        with self.readers.connection() as db_conn:
+            # Read everything from one snapshot, so the watermark matches
+            # what was exported even while the writer is busy
+            db_conn.execute("BEGIN")
+
+            # Counting costs a pass over the index, so only when someone's
+            # watching
+            sizes = [0] * len(queries)
+            if progress is not None:
+                sizes = [
+                    db_conn.execute(count, parameters).fetchone()[0] for count in counts
+                ]
+
+            def rows():
+                done = 0
+                for (query, size) in zip(queries, sizes):
+                    cursor = db_conn.execute(query, parameters)
+                    yield from iter_rows(cursor, progress, sum(sizes), done)
+                    done += size
+
+            start = time.perf_counter()
+            if not continuing:
+                output_file.write(export_format.header)
+            written = write_buffered(
+                output_file, export_format.formatter(rows(), continuing)
+            )
+            self.metrics.observe(
+                "export_seconds", time.perf_counter() - start, format=extension
+            )
+            self.metrics.count("export_characters_total", written, format=extension)
+            self.logger.info("Exported location history as %s", extension)
+
+            (last_id,) = db_conn.execute(
+                "SELECT coalesce(max(id), 0) FROM checkins"
+            ).fetchone()
+            open_ids = [
+                row[0]
+                for row in db_conn.execute(
+                    "SELECT id FROM checkins WHERE end_time IS NULL"
+                )
+            ]
+            (last_update,) = db_conn.execute(
+                "SELECT coalesce(max(id), 0) FROM checkin_updates"
+            ).fetchone()
+
+        return (last_id, open_ids, last_update)
+
+    def export(
+        self,
+        path,
+        since=None,
+        until=None,
+        incremental=False,
+        progress=None,
+        visitors=False,
+        max_bytes=None,
+    ):
+        if max_bytes is not None:
+            if incremental:
+                raise ValueError("Exports split into parts can't be incremental")
+            return self.export_parts(path, max_bytes, since, until, progress, visitors)
+        if incremental and visitors:
+            # The watermark only keeps track of check-ins
+            raise ValueError("Incremental exports can't include visitors")
+
+        (_, extension) = os.path.splitext(path)
+        key = checkpoint_path(path)
+
+        watermark = None
+        if incremental:
+            watermark = self.load_watermark(key)
+
+        # Anything else means a fresh export, replacing whatever's there
+        continuing = watermark is not None
+        reopened = b""
+        if continuing and extension == ".json":
+            continuing = reopen_json_array(path)
+            reopened = b"]" if continuing else b"[]"
+        appending_at = os.path.getsize(path) if watermark else None
+
+        # A fresh export is written alongside, so a failed or cancelled one
+        # leaves the last good export where it was
+        output_path = path if watermark else path + ".tmp"
+
+        try:
+            with open(
+                output_path, mode="a" if watermark else "w", encoding="utf-8"
+            ) as output_file:
+                (last_id, open_ids, last_update) = self.format_as(
+                    extension,
+                    output_file,
+                    since,
+                    until,
+                    watermark,
+                    continuing,
+                    progress,
+                    visitors,
+                )
+        except BaseException:
+            # Don't leave half an export behind; put back what was there
+            try:
+                if appending_at is None:
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                else:
+                    with open(path, mode="rb+") as output_file:
+                        output_file.truncate(appending_at)
+                        output_file.seek(appending_at)
+                        output_file.write(reopened)
+            except OSError:
+                self.logger.exception("Couldn't clean up %s", output_path)
+            raise
+
+        if output_path != path:
+            os.replace(output_path, path)
+
+        self.writer.execute(
+            "INSERT OR REPLACE INTO exports (path, last_id, open_ids, size, last_update) VALUES (?, ?, ?, ?, ?)",
+            (key, last_id, json.dumps(open_ids), os.path.getsize(path), last_update),
+        )
+        self.writer.flush()
+
+    def export_parts(
+        self, path, max_bytes, since=None, until=None, progress=None, visitors=False
+    ):
+        # Exports to path's name with -0001, -0002 and so on added, each no
+        # bigger than max_bytes, so they can be loaded in parallel
+        (_, extension) = os.path.splitext(path)
+        export_format = EXPORT_FORMATS.get(extension)
+        if export_format is None or not export_format.lines:
+            raise ValueError("Only line-based exports can be split into parts")
+
+        output_file = SplitFiles(path, max_bytes, export_format.header)
+        try:
+            # Each part starts with the header, so the formatter mustn't
+            self.format_as(
+                extension, output_file, since, until, None, True, progress, visitors
+            )
+        except BaseException:
+            if output_file.output_file is not None:
+                output_file.output_file.close()
+            for part in output_file.paths:
+                os.remove(part)
+            raise
+        output_file.close()
+
+        # Parts left over from a bigger export before would be confusing
+        for part in glob.glob(output_file.part_pattern()):
+            if part not in output_file.paths:
+                os.remove(part)
+
+        return output_file.paths
+
+    def load_watermark(self, path):
+        with self.readers.connection() as db_conn:
+            row = db_conn.execute(
+                "SELECT last_id, open_ids, size, last_update FROM exports WHERE path = ?",
+                (path,),
+            ).fetchone()
+
+        # If the file has gone or been changed since, start it over
+        if row is None or not os.path.exists(path) or os.path.getsize(path) != row[2]:
+            return None
+
+        return (row[0], json.loads(row[1]), row[3])
+
+    def checkins_between(self, since=None, until=None):
+        with self.readers.connection() as db_conn:
+            rows = db_conn.execute(
+                """
+                SELECT worlds.id, worlds.name, checkins.start_time, checkins.start_offset, checkins.end_time, checkins.end_offset
+                FROM checkins
+                INNER JOIN worlds
+                ON checkins.world_id = worlds.id
+                WHERE checkins.start_time >= :since AND checkins.start_time < :until
+                ORDER BY checkins.start_time
+                """,
+                time_range(since, until),
+            ).fetchall()
 
-CREATE UNIQUE INDEX checkins_world_id_time_unique ON checkins(world_id, start_datetime); 
+        return [
+            (
+                world_id,
+                world_name,
+                from_timestamp(start_time, start_offset),
+                from_timestamp(end_time, end_offset),
+            )
+            for (
+                world_id,
+                world_name,
+                start_time,
+                start_offset,
+                end_time,
+                end_offset,
+            ) in rows
+        ]
+
+    def visitors_between(self, since=None, until=None):
+        with self.readers.connection() as db_conn:
+            rows = db_conn.execute(
+                """
+                SELECT visitors.world_id, players.name, visitors.start_time, visitors.start_offset, visitors.end_time, visitors.end_offset
+                FROM visitors
+                INNER JOIN players
+                ON visitors.player_id = players.id
+                WHERE visitors.start_time >= :since AND visitors.start_time < :until
+                ORDER BY visitors.start_time
+                """,
+                time_range(since, until),
+            ).fetchall()
 
-CREATE TABLE IF NOT EXISTS visitors (
-    world_id TEXT NOT NULL,
-    name TEXT NOT NULL,
-    start_datetime TEXT NOT NULL,
-    end_datetime TEXT,
-    FOREIGN KEY(world_id) REFERENCES worlds(id) ON DELETE CASCADE
-);
+        return [
+            (
+                world_id,
+                name,
+                from_timestamp(start_time, start_offset),
+                from_timestamp(end_time, end_offset),
+            )
+            for (world_id, name, start_time, start_offset, end_time, end_offset) in rows
+        ]
 
-CREATE UNIQUE INDEX visitors_world_id_name_time_unique ON visitors(world_id, name, start_datetime); 
-"""
+    def search(self, query, limit=50):
+        # Quoted, so the query is matched as a piece of text rather than
+        # parsed as FTS5 syntax
+        match = '"{}"'.format(query.replace('"', '""'))
 
-EXPORT_FILETYPES = [("Markdown", ".md"), ("Plain Text", ".txt"), ("JSON Data", ".json")]
+        with self.readers.connection() as db_conn:
+            rows = db_conn.execute(
+                """
+                SELECT worlds.id, worlds.name, checkins.start_time, checkins.start_offset, checkins.end_time, checkins.end_offset, NULL
+                FROM worlds_search
+                INNER JOIN worlds
+                ON worlds.rowid = worlds_search.rowid
+                INNER JOIN checkins
+                ON checkins.world_id = worlds.id
+                WHERE worlds_search MATCH :match
+
+                UNION ALL
+
+                -- The check-in a player was seen during is the last one in
+                -- that world to start before they joined
+                SELECT worlds.id, worlds.name, checkins.start_time, checkins.start_offset, checkins.end_time, checkins.end_offset, players.name
+                FROM players_search
+                INNER JOIN players
+                ON players.id = players_search.rowid
+                INNER JOIN visitors
+                ON visitors.player_id = players.id
+                INNER JOIN checkins
+                ON checkins.world_id = visitors.world_id
+                AND checkins.start_time = (
+                    SELECT max(start_time)
+                    FROM checkins
+                    WHERE world_id = visitors.world_id
+                    AND start_time <= visitors.start_time
+                )
+                INNER JOIN worlds
+                ON worlds.id = checkins.world_id
+                WHERE players_search MATCH :match
 
+                ORDER BY 3 DESC
+                LIMIT :limit
+                """,
+                {"match": match, "limit": limit},
+            ).fetchall()
 
-class FileCreatedEventHandler(FileSystemEventHandler):
-    def __init__(self, app, logger=None):
-        super().__init__()
+        return [
+            (
+                world_id,
+                world_name,
+                from_timestamp(start_time, start_offset),
+                from_timestamp(end_time, end_offset),
+                player_name,
+            )
+            for (
+                world_id,
+                world_name,
+                start_time,
+                start_offset,
+                end_time,
+                end_offset,
+                player_name,
+            ) in rows
+        ]
+
+    def top_worlds(self, limit=10):
+        with self.readers.connection() as db_conn:
+            return db_conn.execute(
+                """
+                SELECT worlds.id, worlds.name, world_stats.visits, world_stats.seconds
+                FROM world_stats
+                INNER JOIN worlds
+                ON world_stats.world_id = worlds.id
+                ORDER BY world_stats.seconds DESC
+                LIMIT :limit
+                """,
+                {"limit": limit},
+            ).fetchall()
 
-        self.app = app
-        self.logger = logger or logging.root
+    def top_players(self, limit=10):
+        with self.readers.connection() as db_conn:
+            return db_conn.execute(
+                """
+                SELECT players.name, player_stats.encounters, player_stats.seconds
+                FROM player_stats
+                INNER JOIN players
+                ON player_stats.player_id = players.id
+                ORDER BY player_stats.encounters DESC
+                LIMIT :limit
+                """,
+                {"limit": limit},
+            ).fetchall()
 
-    def on_created(self, event):
-        super().on_created(event)
+    def daily_activity(self, limit=14):
+        with self.readers.connection() as db_conn:
+            return db_conn.execute(
+                "SELECT day, checkins, seconds FROM daily_stats ORDER BY day DESC LIMIT :limit",
+                {"limit": limit},
+            ).fetchall()
 
-        if event.is_directory:
-            return
+    def format_stats(self, limit=10):
+        lines = ["Most time spent:"]
+        lines.extend(
+            "  {} - {} over {} visits".format(
+                (world_name or world_id), format_duration(seconds), visits
+            )
+            for (world_id, world_name, visits, seconds) in self.top_worlds(limit)
+        )
 
-        relpath = os.path.relpath(event.src_path, self.app.vrchat_data_dir)
+        lines.append("")
+        lines.append("Most seen:")
+        lines.extend(
+            "  {} - {} times, {}".format(name, encounters, format_duration(seconds))
+            for (name, encounters, seconds) in self.top_players(limit)
+        )
 
-        if not relpath.startswith("output_log"):
-            return
+        lines.append("")
+        lines.append("Recent days:")
+        lines.extend(
+            "  {} - {} worlds, {}".format(day, checkins, format_duration(seconds))
+            for (day, checkins, seconds) in self.daily_activity(limit)
+        )
 
-        self.logger.info("VRChat log file detected: %s", relpath)
+        return "\n".join(lines)
 
-        vrchat_process = None
-        for process in psutil.process_iter(["name"]):
-            if process.info["name"] == "VRChat.exe":
-                vrchat_process = process
-                break
+    def on_stats(self, icon, item):
+        from tkinter import messagebox
 
-        self.logger.info("VRChat process detected: %d", vrchat_process.pid)
+        messagebox.showinfo(title="WarpTrail Statistics", message=self.format_stats())
 
-        Thread(
-            target=self.app.follow_log_file, args=(event.src_path, vrchat_process)
-        ).start()
+    def on_diagnostics(self, icon, item):
+        from tkinter import messagebox
 
+        messagebox.showinfo(
+            title="WarpTrail Diagnostics", message=self.metrics.format_summary()
+        )
 
-VRCHAT_DIR = "%LOCALAPPDATA%\\..\\LocalLow\\VRChat\\VRChat"
+    def on_toggle_profiling(self, icon, item):
+        self.metrics.profiling = not self.metrics.profiling
+        self.logger.info(
+            "Profiling %s", "started" if self.metrics.profiling else "stopped"
+        )
 
+    def on_export(self, icon, item):
+        self.export_with_dialog()
 
-class WarpTrailApp:
-    def get_user_data_dir():
-        user_data_dir = AppDirs("WarpTrail", "ticky").user_data_dir
-        old_user_data_dir = AppDirs("VRCTracker", "ticky").user_data_dir
+    def on_export_week(self, icon, item):
+        self.export_with_dialog(
+            initialfile="WarpTrail Last Week",
+            since=datetime.now(local_tz()) - timedelta(days=7),
+        )
 
-        if not os.path.isdir(user_data_dir):
-            # Migrate old data if it exists
-            if os.path.isdir(old_user_data_dir):
-                os.rename(old_user_data_dir, user_data_dir)
-                os.rename(
-                    os.path.join(user_data_dir, "VRCTracker.db"),
-                    os.path.join(user_data_dir, "WarpTrail.db"),
-                )
+    def on_export_new(self, icon, item):
+        # Picking a file exported this way before adds to it
+        self.export_with_dialog(confirmoverwrite=False, incremental=True)
 
-            else:
-                os.makedirs(user_data_dir, exist_ok=True)
+    def export_with_dialog(
+        self, initialfile="WarpTrail History", confirmoverwrite=True, **options
+    ):
+        from tkinter import filedialog
 
-        return user_data_dir
+        outfilename = filedialog.asksaveasfilename(
+            title="Save VRChat Location History",
+            initialfile=initialfile,
+            filetypes=export_filetypes(),
+            defaultextension=export_filetypes(),
+            confirmoverwrite=confirmoverwrite,
+        )
+        if not outfilename:
+            return
 
-    def get_vrchat_data_dir():
-        expanded_dir = os.path.expandvars(VRCHAT_DIR)
+        (_, extension) = os.path.splitext(outfilename)
 
-        # Fallback for non-windows systems
-        if expanded_dir == VRCHAT_DIR:
-            return AppDirs("VRChat", "VRChat").user_data_dir
+        self.logger.info(
+            "Saving location history as %s, with format %s", outfilename, extension
+        )
 
-        return os.path.abspath(expanded_dir)
+        self.export_job = ExportJob(
+            self,
+            outfilename,
+            on_progress=self.on_export_progress,
+            on_done=self.on_export_done,
+            **options,
+        )
+        self.export_job.start()
+        self.icon.update_menu()
+
+    def on_export_progress(self, job):
+        # Called for every chunk of rows, which is far more often than anyone
+        # can read a tooltip
+        now = time.monotonic()
+        if now < self.export_progress_shown + EXPORT_PROGRESS_INTERVAL:
+            return
+        self.export_progress_shown = now
 
-    def __init__(
-        self,
-        user_data_dir=get_user_data_dir(),
-        vrchat_data_dir=get_vrchat_data_dir(),
-        database_path=None,
-        logger=None,
-    ):
-        self.logger = logger or logging.root
+        self.icon.title = "WarpTrail - Exporting {:,} of {:,} rows".format(
+            job.written, job.total
+        )
 
-        self.logger.debug("user_data_dir: %s", user_data_dir)
+    def on_export_done(self, job):
+        from tkinter import messagebox
 
-        self.vrchat_data_dir = vrchat_data_dir
+        self.export_job = None
+        self.export_progress_shown = 0.0
+        self.icon.title = "WarpTrail"
+        self.icon.update_menu()
 
-        self.logger.debug("vrchat_data_dir: %s", self.vrchat_data_dir)
+        if job.error is not None:
+            messagebox.showerror(title="WarpTrail", message=str(job.error))
 
-        if not os.path.exists(self.vrchat_data_dir):
-            print("{} could not be found".format(self.vrchat_data_dir))
-            return
+    def on_cancel_export(self, icon, item):
+        job = self.export_job
+        if job is not None:
+            job.cancel()
 
-        if database_path is None:
-            self.database_path = os.path.join(user_data_dir, "WarpTrail.db")
-        else:
-            self.database_path = database_path
+    def on_exit(self, icon, item):
+        self.stop()
+        icon.stop()
 
-        self.logger.debug("database_path: %s", self.database_path)
-        db_conn = sqlite3.connect(self.database_path)
+    def stop(self):
+        self.stop_event.set()
 
-        db = db_conn.cursor()
-        db_check = db.execute(
-            "SELECT count(*) FROM sqlite_master WHERE type='table' AND name='checkins';"
-        ).fetchone()
-        if db_check[0] == 0:
-            self.logger.info("initialising database...")
-            db.executescript(DB_SCHEMA)
-            db_conn.commit()
-            self.logger.info("database ready")
+        # Rather than leave half an export behind
+        job = self.export_job
+        if job is not None:
+            job.cancel()
+            job.thread.join()
+
+        # Followers see the stop event and finish up; watch_log_files waits
+        # for them to save their checkpoints
+        self.readers.close()
+        for wakeup in list(self.log_wakeups.values()):
+            wakeup.set()
+
+    def run(self):
+        from PIL import Image
+        import pystray
+
+        self.stop_event = ThreadingEvent()
+        self.watch_stopped = ThreadingEvent()
 
         if APP_EMBEDDED:
             iconimage = Image.open(
@@ -161,140 +2782,271 @@ class WarpTrailApp:
         else:
             iconimage = Image.open("resources/warptrail.ico")
 
+        def idle(item):
+            return self.export_job is None
+
         self.icon = pystray.Icon(
             "WarpTrail",
             icon=iconimage,
             title="WarpTrail",
             menu=pystray.Menu(
-                pystray.MenuItem("Export Location History...", self.on_export),
+                pystray.MenuItem(
+                    "Export Location History...", self.on_export, enabled=idle
+                ),
+                pystray.MenuItem(
+                    "Export Last Week...", self.on_export_week, enabled=idle
+                ),
+                pystray.MenuItem(
+                    "Export New Since Last Time...", self.on_export_new, enabled=idle
+                ),
+                pystray.MenuItem(
+                    "Cancel Export",
+                    self.on_cancel_export,
+                    visible=lambda item: self.export_job is not None,
+                ),
+                pystray.MenuItem("Statistics...", self.on_stats),
+                pystray.MenuItem("Diagnostics...", self.on_diagnostics),
+                pystray.MenuItem(
+                    "Capture Profile",
+                    self.on_toggle_profiling,
+                    checked=lambda item: self.metrics.profiling,
+                ),
                 pystray.Menu.SEPARATOR,
                 pystray.MenuItem("Exit", self.on_exit),
             ),
         )
 
-    def format_as(self, extension, output_file):
-        db_conn = sqlite3.connect(self.database_path)
-        db_conn.row_factory = sqlite3.Row
-        db = db_conn.cursor()
+        self.icon.run(setup=self.pystray_setup)
 
-        # TODO: Gracefully handle errors fetching from database
-        if extension == ".md":
-            result = db.execute(
+        # The icon's gone, but followers may still be saving checkpoints
+        self.watch_stopped.wait()
+
+    def backfill(self, paths=None, max_workers=None, compression=ARCHIVE_COMPRESSION):
+        if paths is None:
+            paths = find_log_files(self.vrchat_data_dir)
+
+            # The newest log belongs to VRChat while it's running, so leave
+            # that one to follow_log_file
+            if paths and self.vrchat_processes.find() is not None:
+                paths = paths[:-1]
+
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed = {executor.submit(parse_log_file, path): path for path in paths}
+
+            archived = {}
+            if self.archive_logs:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                archived = {
+                    executor.submit(
+                        archive_log_file,
+                        path,
+                        self.archive_path(path, compression),
+                        self.archive_block_size,
+                    ): path
+                    for path in self.unarchived(paths)
+                }
+
+            for future in as_completed([*parsed, *archived]):
+                if future in archived:
+                    self.writer.submit(partial(store_archive, archive=future.result()))
+                    self.logger.info("Archived %s", archived[future])
+                else:
+                    # Each file is written in one go, and the unique indexes
+                    # make re-running over the same logs a no-op
+                    self.store_parsed(parsed[future], *future.result())
+
+        self.writer.flush()
+
+    def reingest(self, since=None, until=None, max_workers=None):
+        # Parses archived logs again with the current rules. With since or
+        # until, only the blocks which cover that time are read
+        with self.readers.connection() as db_conn:
+            rows = db_conn.execute(
                 """
-                SELECT worlds.id, worlds.name, checkins.start_datetime, checkins.end_datetime
-                FROM checkins
-                INNER JOIN worlds
-                ON checkins.world_id = worlds.id
-            """
+                SELECT archives.file, archives.mtime, archive_blocks.offset, archive_blocks.length, archive_blocks.offset = (
+                    SELECT max(last_block.offset) FROM archive_blocks AS last_block WHERE last_block.archive_id = archives.id
+                )
+                FROM archive_blocks
+                INNER JOIN archives
+                ON archive_blocks.archive_id = archives.id
+                WHERE archive_blocks.start_time < :until AND archive_blocks.end_time >= :since
+                ORDER BY archives.id, archive_blocks.offset
+                """,
+                time_range(since, until),
             ).fetchall()
 
-            self.logger.info("History: {}".format(result))
-
-            output_file.write("# WarpTrail Location History\n\n")
-            output_file.writelines(
-                """- [{}](https://vrch.at/{})  
-  from {} until {}
-""".format(
-                    (row["name"] or row["id"]),
-                    row["id"],
-                    default_tzinfo(parse_date(row["start_datetime"]), gettz()).strftime(
-                        "%d/%m/%Y, %H:%M"
-                    )
-                    if row["start_datetime"]
-                    else "(unknown)",
-                    default_tzinfo(parse_date(row["end_datetime"]), gettz()).strftime(
-                        "%d/%m/%Y, %H:%M"
-                    )
-                    if row["end_datetime"]
-                    else "(unknown)",
-                )
-                for row in result
+        archives = {}
+        for (file, mtime, offset, length, is_last) in rows:
+            archive = archives.setdefault(file, {"blocks": [], "mtime": None})
+            archive["blocks"].append((offset, length))
+            if is_last:
+                archive["mtime"] = mtime
+
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    parse_archive,
+                    os.path.join(self.archive_dir, file),
+                    archive["blocks"],
+                    archive["mtime"],
+                ): file
+                for (file, archive) in archives.items()
+            }
+
+            for future in as_completed(futures):
+                self.store_parsed(futures[future], *future.result())
+
+        self.writer.flush()
+
+    def store_parsed(self, name, worlds, checkins, visitors):
+        self.writer.submit(
+            partial(
+                store_parsed_log,
+                worlds=worlds,
+                checkins=checkins,
+                visitors=visitors,
+                player_id=self.writer.player_id,
             )
+        )
 
-        elif extension == ".txt":
-            result = db.execute(
-                """
-                SELECT worlds.id, worlds.name, checkins.start_datetime, checkins.end_datetime
-                FROM checkins
-                INNER JOIN worlds
-                ON checkins.world_id = worlds.id
-            """
-            ).fetchall()
+        self.logger.info(
+            "Backfilled %s: %d checkins, %d visitors",
+            name,
+            len(checkins),
+            len(visitors),
+        )
 
-            self.logger.info("History: {}".format(result))
+    def archive_path(self, path, compression=ARCHIVE_COMPRESSION):
+        return os.path.join(self.archive_dir, os.path.basename(path) + compression)
 
-            output_file.writelines(
-                "{} (https://vrch.at/{}), from {} until {}\n".format(
-                    (row["name"] or row["id"]),
-                    row["id"],
-                    default_tzinfo(parse_date(row["start_datetime"]), gettz()).strftime(
-                        "%d/%m/%Y, %H:%M"
-                    )
-                    if row["start_datetime"]
-                    else "(unknown)",
-                    default_tzinfo(parse_date(row["end_datetime"]), gettz()).strftime(
-                        "%d/%m/%Y, %H:%M"
-                    )
-                    if row["end_datetime"]
-                    else "(unknown)",
-                )
-                for row in result
-            )
+    def unarchived(self, paths):
+        with self.readers.connection() as db_conn:
+            sizes = dict(db_conn.execute("SELECT name, size FROM archives"))
 
-        elif extension == ".json":
-            result = db.execute(
-                """
-                SELECT json_group_array(json_object(
-                    'world_name', worlds.name, 
-                    'world_url', 'https://vrch.at/' || worlds.id,
-                    'start_datetime', checkins.start_datetime,
-                    'end_datetime', checkins.end_datetime 
-                ))
-                FROM checkins
-                INNER JOIN worlds
-                ON checkins.world_id = worlds.id
-            """
-            ).fetchone()
+        return [
+            path
+            for path in paths
+            if sizes.get(os.path.basename(path)) != os.path.getsize(path)
+        ]
 
-            output_file.write(result[0])
-        else:
-            raise NotImplementedError("Unexpected file extension: {}".format(extension))
+    def archive_log(self, path, compression=ARCHIVE_COMPRESSION):
+        if not self.archive_logs or not self.unarchived([path]):
+            return
 
-        db_conn.commit()
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            archive = archive_log_file(
+                path, self.archive_path(path, compression), self.archive_block_size
+            )
+        except OSError:
+            self.logger.exception("Couldn't archive %s", path)
+            return
 
-    def on_export(self, icon, item):
-        outfilename = filedialog.asksaveasfilename(
-            title="Save VRChat Location History",
-            initialfile="WarpTrail History",
-            filetypes=EXPORT_FILETYPES,
-            defaultextension=EXPORT_FILETYPES,
+        self.writer.submit(partial(store_archive, archive=archive))
+        self.logger.info("Archived %s", path)
+
+    def maintenance_tasks(self):
+        tasks = [
+            ("close_orphans", close_orphaned_sessions),
+            ("merge_checkins", merge_adjacent_checkins),
+        ]
+        if self.visitor_retention is not None:
+            before = int(time.time()) - self.visitor_retention * 24 * 60 * 60
+            tasks.append(
+                ("visitor_retention", partial(delete_old_visitors, before=before))
+            )
+        tasks += [("vacuum", vacuum_incrementally), ("optimize", optimize_database)]
+        return tasks
+
+    def maintenance_due(self):
+        # Only once VRChat has been closed for a while, so nothing's waiting
+        # on the writer
+        if self.followers.active:
+            self.last_active = time.monotonic()
+            return False
+        if time.monotonic() - self.last_active < MAINTENANCE_IDLE_DELAY:
+            return False
+
+        with self.readers.connection() as db_conn:
+            last_runs = dict(db_conn.execute("SELECT task, last_run FROM maintenance"))
+
+        now = time.time()
+        return any(
+            now - last_runs.get(task, 0) >= MAINTENANCE_INTERVAL
+            for (task, _) in self.maintenance_tasks()
         )
 
-        (_, extension) = os.path.splitext(outfilename)
+    def maintain(self, interrupted=None):
+        # Runs every task on the writer thread, one after another. If
+        # interrupted() becomes true, the rest wait for next time
+        results = {}
+        for (task, function) in self.maintenance_tasks():
+            start = time.perf_counter()
+            changes = 0
+            while True:
+                if interrupted is not None and interrupted():
+                    self.logger.info("Maintenance interrupted before %s", task)
+                    return results
+
+                done = []
+                self.writer.submit(lambda db: done.append(function(db)))
+                self.writer.flush()
+                if not done:
+                    # The writer's already logged why
+                    break
 
-        self.logger.info(
-            "Saving location history as %s, with format %s", outfilename, extension
-        )
+                changes += done[0]
+                # Tasks working a chunk at a time go again until they run out
+                if done[0] < MAINTENANCE_CHUNK_SIZE:
+                    break
 
-        with open(outfilename, mode="w", encoding="utf-8") as output_file:
-            try:
-                self.format_as(extension, output_file)
-            except Exception as e:
-                messagebox.showerror(
-                    title="WarpTrail",
-                    message=str(e),
-                )
+            self.writer.execute(
+                "INSERT INTO maintenance (task, last_run, changes) VALUES (?, ?, ?) ON CONFLICT(task) DO UPDATE SET last_run = excluded.last_run, changes = excluded.changes",
+                (task, int(time.time()), changes),
+            )
+            self.metrics.observe(
+                "maintenance_seconds", time.perf_counter() - start, task=task
+            )
+            self.metrics.count("maintenance_changes_total", changes, task=task)
+            self.logger.info("Maintenance: %s (%d changes)", task, changes)
+            results[task] = changes
 
-    def on_exit(self, icon, item):
-        self.stop_event.set()
-        icon.stop()
+        self.writer.flush()
+        return results
+
+    def run_headless(self):
+        # Follows logs just like the tray app, until interrupted
+        if not os.path.isdir(self.vrchat_data_dir):
+            self.logger.error("Can't follow logs in %s", self.vrchat_data_dir)
+            return
 
-    def run(self):
         self.stop_event = ThreadingEvent()
-        self.icon.run(setup=self.pystray_setup)
+        self.watch_stopped = ThreadingEvent()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        self.watch_log_files()
 
     def pystray_setup(self, icon):
         icon.visible = True
+        self.watch_log_files()
+
+    def watch_log_files(self):
+        try:
+            self.watch_until_stopped()
+        finally:
+            self.watch_stopped.set()
+
+    def watch_until_stopped(self):
+        from watchdog.observers import Observer
+
+        # The tray app is still good for exporting what we already have
+        if not os.path.isdir(self.vrchat_data_dir):
+            self.logger.warning("%s could not be found", self.vrchat_data_dir)
+            return
 
         event_handler = FileCreatedEventHandler(self, self.logger)
         observer = Observer()
@@ -302,150 +3054,427 @@ class WarpTrailApp:
         observer.start()
 
         try:
-            while True:
-                if self.stop_event.is_set():
-                    observer.stop()
-                    break
-
-                time.sleep(1)
+            self.resume_log_files()
+
+            # Nothing to do between maintenance checks, so sleep until then,
+            # or until we're told to stop
+            while not self.stop_event.wait(MAINTENANCE_CHECK_INTERVAL):
+                if self.maintenance_due():
+                    self.maintain(
+                        lambda: self.stop_event.is_set() or bool(self.followers.active)
+                    )
         except KeyboardInterrupt:
+            self.stop()
+        finally:
             observer.stop()
+            observer.join()
+
+            # Let the followers save their checkpoints before we go
+            self.followers.stop(wait=True)
+
+    def follow_in_background(self, path, responsible_process):
+        return self.followers.start(path, responsible_process)
 
-        observer.join()
+    def notify_log_modified(self, path):
+        wakeup = self.log_wakeups.get(checkpoint_path(path))
+        if wakeup is not None:
+            wakeup.set()
+
+    def resume_log_files(self):
+        newest_path = next(reversed(find_log_files(self.vrchat_data_dir)), None)
+        vrchat_process = None
+        if newest_path is not None:
+            vrchat_process = self.vrchat_processes.find(log_created_time(newest_path))
+            if vrchat_process is None:
+                newest_path = None
+
+        with self.readers.connection() as db_conn:
+            paths = [
+                row[0]
+                for row in db_conn.execute(
+                    "SELECT path FROM checkpoints WHERE finished = 0"
+                ).fetchall()
+            ]
+
+        # If VRChat was already running when we started, its log was created
+        # before we were watching for it
+        if newest_path is not None:
+            newest_path = checkpoint_path(newest_path)
+            if newest_path not in paths:
+                paths.append(newest_path)
+
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+
+            self.logger.info("Resuming VRChat log file: %s", path)
+            self.follow_in_background(
+                path, vrchat_process if path == newest_path else None
+            )
+
+    def load_checkpoint(self, path, file_id, size):
+        # Make sure anything an earlier follower of this log wrote is visible
+        self.writer.flush()
+
+        with self.readers.connection() as db_conn:
+            row = db_conn.execute(
+                "SELECT file_id, size, offset, world_id FROM checkpoints WHERE path = :path",
+                {"path": path},
+            ).fetchone()
+
+        # A different or truncated file means VRChat has started over
+        if row is None or row[0] != file_id or row[1] > size:
+            return (0, None)
+
+        return (row[2], row[3])
+
+    def save_checkpoint(self, path, file_id, size, offset, world_id, finished=False):
+        self.writer.execute(
+            "INSERT OR REPLACE INTO checkpoints (path, file_id, size, offset, world_id, finished) VALUES (:path, :file_id, :size, :offset, :world_id, :finished)",
+            {
+                "path": path,
+                "file_id": file_id,
+                "size": size,
+                "offset": offset,
+                "world_id": world_id,
+                "finished": finished,
+            },
+        )
 
     def follow_log_file(self, path, responsible_process):
         # https://medium.com/@aliasav/how-follow-a-file-in-python-tail-f-in-python-bca026a901cf
-        with open(path, mode="r", encoding="utf-8", errors="ignore") as input_file:
-            db_conn = sqlite3.Connection(self.database_path)
-            db = db_conn.cursor()
-            world_id = None
+        path = checkpoint_path(path)
+
+        # Read bytes rather than text, so the offsets we store are exact
+        with open(path, mode="rb") as input_file:
+            stat = os.fstat(input_file.fileno())
+            file_id = file_identity(stat)
+            (offset, world_id) = self.load_checkpoint(path, file_id, stat.st_size)
+            if offset:
+                self.logger.info("Resuming %s from byte %d", path, offset)
+                input_file.seek(offset)
+
+            database = DatabaseSink(self.writer, world_id, self.logger)
+            dispatcher = EventDispatcher(
+                [database, *(open_sink(path) for open_sink in self.sink_factories)],
+                self.logger,
+            )
+
+            # The size is saved as well, so a truncated log can be told apart
+            def save_checkpoint(finished=False):
+                self.save_checkpoint(
+                    path,
+                    file_id,
+                    os.fstat(input_file.fileno()).st_size,
+                    offset,
+                    database.world_id,
+                    finished,
+                )
+
+            # Whether anything has happened since the checkpoint was saved
+            unsaved = False
+            finished = False
+
+            wakeup = ThreadingEvent()
+            self.log_wakeups[path] = wakeup
+            pending = b""
+            delay = TAIL_MIN_DELAY
+            next_process_check = time.monotonic()
+
+            metrics = self.metrics
+            log_name = os.path.basename(path)
+            profile = None
 
             while not self.stop_event.is_set():
-                line = input_file.readline()
+                wakeup.clear()
+                profile = metrics.update_profile(profile)
 
-                if not line:
-                    if (
-                        responsible_process == None
-                        or not responsible_process.is_running()
-                    ):
-                        break
+                read_start = time.perf_counter()
+                chunk = input_file.read(LOG_CHUNK_SIZE)
 
-                    time.sleep(0.1)
-                    continue
+                if not chunk:
+                    metrics.set("tail_lag_bytes", 0, file=log_name)
 
-                last_world_id = world_id
+                    if unsaved:
+                        save_checkpoint()
+                        unsaved = False
 
-                # Regexes inspired by https://github.com/sunasaji/VRC_log_checker
+                    if responsible_process == None:
+                        finished = True
+                        break
 
-                # Gather world IDs from Joining messages
-                match = re.search(
-                    "([0-9.]+ [0-9:]+).+Joining (wrld_[0-9a-f-]{36})", line
-                )
-                if match != None:
-                    date = default_tzinfo(parse_date(match.group(1)), gettz())
-                    world_id = match.group(2)
+                    now = time.monotonic()
+                    if now >= next_process_check:
+                        if not responsible_process.is_running():
+                            finished = True
+                            break
 
-                    self.logger.info(
-                        "Entered world %s at %s", world_id, date.isoformat()
-                    )
+                        next_process_check = now + PROCESS_CHECK_INTERVAL
 
-                    # Update any unresolved checkins and visitors to the previous world to have ended
-                    db.execute(
-                        "UPDATE checkins SET end_datetime = :end_datetime WHERE world_id = :last_world_id AND end_datetime IS NULL",
-                        {
-                            "end_datetime": date.isoformat(),
-                            "last_world_id": last_world_id,
-                        },
-                    )
-                    db.execute(
-                        "UPDATE visitors SET end_datetime = :end_datetime WHERE world_id = :last_world_id AND end_datetime IS NULL",
-                        {
-                            "end_datetime": date.isoformat(),
-                            "last_world_id": last_world_id,
-                        },
-                    )
-                    # Insert a world ID value, but ignore if there's a conflict
-                    db.execute(
-                        "INSERT OR IGNORE INTO worlds (id) VALUES (:id)",
-                        {"id": world_id},
-                    )
-                    # Insert a fresh checkin beginning at this time
-                    db.execute(
-                        "INSERT OR IGNORE INTO checkins (world_id, start_datetime) VALUES (:world_id, :start_datetime)",
-                        {"world_id": world_id, "start_datetime": date.isoformat()},
-                    )
-                    db_conn.commit()
+                    # Sleep until watchdog tells us the log has changed
+                    if wakeup.wait(delay):
+                        delay = TAIL_MIN_DELAY
+                    else:
+                        delay = min(delay * 2, TAIL_MAX_DELAY)
+
+                    continue
 
-                # Gather world names from Joining messages
-                match = re.search(
-                    "[0-9.]+ [0-9:]+.+Joining or Creating Room: (.+)", line
+                delay = TAIL_MIN_DELAY
+                metrics.observe(
+                    "stage_seconds", time.perf_counter() - read_start, stage="read"
+                )
+                metrics.count("bytes_read_total", len(chunk))
+                metrics.set(
+                    "tail_lag_bytes",
+                    os.fstat(input_file.fileno()).st_size - input_file.tell(),
+                    file=log_name,
                 )
-                if match != None:
-                    name = match.group(1)
-                    self.logger.info('Found world name: "%s"', name)
-                    db.execute(
-                        "UPDATE worlds SET name = :name WHERE id = :id",
-                        {"name": name, "id": world_id},
-                    )
-                    db_conn.commit()
-
-                # Gather player names from OnPlayerJoined/Left events
-                match = re.search("([0-9.]+ [0-9:]+).+OnPlayerJoined (.+)", line)
-                if match != None:
-                    date = default_tzinfo(parse_date(match.group(1)), gettz())
-                    name = match.group(2)
-                    self.logger.info(
-                        'Player "%s" Joined, at %s', name, date.isoformat()
-                    )
-                    db.execute(
-                        "INSERT OR IGNORE INTO visitors (world_id, name, start_datetime) VALUES (:world_id, :name, :start_datetime)",
-                        {
-                            "world_id": world_id,
-                            "name": name,
-                            "start_datetime": date.isoformat(),
-                        },
-                    )
 
-                match = re.search("([0-9.]+ [0-9:]+).+OnPlayerLeft (.+)", line)
-                if match != None:
-                    date = default_tzinfo(parse_date(match.group(1)), gettz())
-                    name = match.group(2)
-                    self.logger.info('Player "%s" Left, at %s', name, date.isoformat())
-                    db.execute(
-                        "UPDATE visitors SET end_datetime = :end_datetime WHERE name = :name AND world_id = :world_id AND end_datetime IS NULL",
-                        {
-                            "end_datetime": date,
-                            "name": name,
-                            "world_id": world_id,
-                        },
-                    )
+                # Anything after the last newline is a line VRChat is still
+                # part way through writing; hold on to it until it's finished
+                raw_lines = (pending + chunk).split(b"\n")
+                offset += len(pending) + len(chunk)
+                pending = raw_lines.pop()
+                offset -= len(pending)
+                metrics.count("lines_read_total", len(raw_lines))
+
+                # Timing every line would cost more than classifying it, so
+                # only the (rare) events are timed individually
+                process_start = time.perf_counter()
+                handle_seconds = 0.0
+                changed_world = False
+
+                lines = (
+                    raw_line.decode("utf-8", errors="ignore").rstrip("\r")
+                    for raw_line in raw_lines
+                )
+                for event in iter_events(lines):
+                    handle_start = time.perf_counter()
+                    metrics.count("lines_matched_total", kind=event.kind)
+                    dispatcher.dispatch(event)
+                    unsaved = True
+                    changed_world |= event.kind in ("world_join", "world_name")
+                    handle_seconds += time.perf_counter() - handle_start
+
+                handle_start = time.perf_counter()
+                dispatcher.flush()
+                handle_seconds += time.perf_counter() - handle_start
+
+                metrics.observe(
+                    "stage_seconds",
+                    time.perf_counter() - process_start - handle_seconds,
+                    stage="classify",
+                )
+                metrics.observe("stage_seconds", handle_seconds, stage="handle")
+
+                # A new world is worth saving straight away; players coming
+                # and going can wait until the log goes quiet
+                if changed_world:
+                    save_checkpoint()
+                    unsaved = False
+
+            metrics.finish_profile(profile)
+            del self.log_wakeups[path]
+
+            # Nothing more is coming, so a last line without a newline is
+            # as finished as it will ever be
+            if finished and pending:
+                line = pending.decode("utf-8", errors="ignore").rstrip("\r")
+                for event in iter_events([line]):
+                    metrics.count("lines_matched_total", kind=event.kind)
+                    dispatcher.dispatch(event)
+                dispatcher.flush()
+                offset += len(pending)
+
+            # VRChat writes to its log right up until it exits, so that's when
+            # anything still open must have ended
+            end = None
+            if finished:
+                end = to_timestamp(
+                    datetime.fromtimestamp(os.path.getmtime(path), local_tz())
+                )
+            dispatcher.close(end)
 
-            # Update any unresolved checkins and visitors to the previous world to have ended
-            db.execute(
-                "UPDATE checkins SET end_datetime = :end_datetime WHERE world_id = :world_id AND end_datetime IS NULL",
-                {
-                    "end_datetime": default_tzinfo(datetime.now(), gettz()).isoformat(),
-                    "world_id": world_id,
-                },
-            )
-            db.execute(
-                "UPDATE visitors SET end_datetime = :end_datetime WHERE world_id = :world_id AND end_datetime IS NULL",
-                {
-                    "end_datetime": default_tzinfo(datetime.now(), gettz()).isoformat(),
-                    "world_id": world_id,
-                },
-            )
-            db_conn.commit()
+            save_checkpoint(finished)
+            self.writer.flush()
 
             self.logger.info("Stopped processing %s", path)
 
+        # VRChat will eventually delete the log, so keep a copy of it
+        if finished:
+            self.archive_log(path)
+
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s: %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
+    parser = argparse.ArgumentParser(prog="WarpTrail")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve diagnostics at http://127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="capture cProfile data until turned off from the tray menu",
+    )
+    parser.add_argument(
+        "--feed",
+        metavar="PATH",
+        help="append each world and player event to PATH as it happens, as JSON lines",
+    )
+    parser.add_argument(
+        "--visitor-retention",
+        type=int,
+        metavar="DAYS",
+        help="delete who you met more than DAYS days ago during maintenance",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="import VRChat logs which already exist"
+    )
+    backfill_parser.add_argument(
+        "paths", nargs="*", help="log files to import (default: all VRChat logs)"
+    )
+    backfill_parser.add_argument(
+        "--jobs", type=int, help="number of log files to parse at once"
+    )
+    backfill_parser.add_argument(
+        "--compression",
+        choices=[".gz", ".xz"],
+        default=ARCHIVE_COMPRESSION,
+        help="how to compress archived copies of the logs (default: %(default)s)",
+    )
+    backfill_parser.add_argument(
+        "--no-archive",
+        dest="archive",
+        action="store_false",
+        help="don't keep archived copies of the logs",
+    )
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="save location history as Markdown, text, JSON, CSV or JSON Lines",
+    )
+    export_parser.add_argument(
+        "path",
+        help="file to save to; its extension (.md, .txt, .json, .csv or .ndjson) is the format",
+    )
+    export_parser.add_argument(
+        "--since", type=parse_date_argument, help="only check-ins from this time on"
+    )
+    export_parser.add_argument(
+        "--until", type=parse_date_argument, help="only check-ins before this time"
+    )
+    export_parser.add_argument(
+        "--visitors",
+        action="store_true",
+        help="include who was there too (.csv and .ndjson only)",
+    )
+    export_parser.add_argument(
+        "--max-bytes",
+        type=int,
+        help="split into numbered files no bigger than this (.csv and .ndjson only)",
+    )
+    export_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="add what's new since this file was last exported, rather than starting over",
+    )
+
+    reingest_parser = subparsers.add_parser(
+        "reingest", help="read archived logs again, with the current rules"
+    )
+    reingest_parser.add_argument(
+        "--since", type=parse_date_argument, help="only read logs from this time on"
+    )
+    reingest_parser.add_argument(
+        "--until", type=parse_date_argument, help="only read logs before this time"
+    )
+    reingest_parser.add_argument(
+        "--jobs", type=int, help="number of archives to read at once"
+    )
+
+    subparsers.add_parser(
+        "maintain",
+        help="tidy up and compact the database now, rather than waiting until it's due",
+    )
+
+    subparsers.add_parser(
+        "daemon", help="follow VRChat logs in the background, without a tray icon"
+    )
+
+    search_parser = subparsers.add_parser(
+        "search", help="find visits by world or player name"
+    )
+    search_parser.add_argument("query", help="part of a world or player name")
+    search_parser.add_argument(
+        "--limit", type=int, default=50, help="number of visits to show"
+    )
+
+    stats_parser = subparsers.add_parser(
+        "stats", help="show where you've spent the most time, and with whom"
+    )
+    stats_parser.add_argument(
+        "--limit", type=int, default=10, help="number of entries to show in each list"
+    )
+
+    args = parser.parse_args()
+
     app = WarpTrailApp()
-    app.run()
+    app.metrics.profiling = args.profile
+    app.visitor_retention = args.visitor_retention
+    if args.feed is not None:
+        app.sink_factories.append(partial(FeedSink, args.feed))
+
+    if args.metrics_port is not None:
+        serve_metrics(app.metrics, args.metrics_port)
+
+    if args.command == "backfill":
+        app.archive_logs = args.archive
+        app.backfill(
+            paths=args.paths or None,
+            max_workers=args.jobs,
+            compression=args.compression,
+        )
+    elif args.command == "export":
+        app.export(
+            args.path,
+            since=args.since,
+            until=args.until,
+            incremental=args.incremental,
+            visitors=args.visitors,
+            max_bytes=args.max_bytes,
+        )
+    elif args.command == "reingest":
+        app.reingest(since=args.since, until=args.until, max_workers=args.jobs)
+    elif args.command == "search":
+        for (world_id, world_name, start, end, player_name) in app.search(
+            args.query, args.limit
+        ):
+            print(
+                "{} (https://vrch.at/{}), from {} until {}{}".format(
+                    (world_name or world_id),
+                    world_id,
+                    start.strftime("%d/%m/%Y, %H:%M"),
+                    end.strftime("%d/%m/%Y, %H:%M") if end else "(unknown)",
+                    ", with {}".format(player_name) if player_name else "",
+                )
+            )
+    elif args.command == "stats":
+        print(app.format_stats(args.limit))
+    elif args.command == "maintain":
+        for (task, changes) in app.maintain().items():
+            print("{}: {} changes".format(task, changes))
+    elif args.command == "daemon":
+        app.run_headless()
+    else:
+        app.run()